@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Microbenchmark of the aggregation of InfluxDB series by the pure Python
+   and the NumPy aggregators, for jobs of 10, 100 and 1000 nodes.
+
+   Usage: python bench/aggregation.py [points]
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'rest'))
+
+from jobmetrics.Conf import Conf
+from jobmetrics.Aggregator import PythonAggregator, NumpyAggregator
+
+# metrics of the registry of the configuration
+conf = Conf()
+metrics = conf.metrics.keys()
+
+
+def gen_series(nodes, points):
+    """Returns the list of (metric, node, values) series as returned by
+       InfluxDB for a job running on the given number of nodes."""
+
+    start = 1500000000000
+    timestamps = [start + i * 10000 for i in range(points)]
+    series = []
+    for metric in metrics:
+        if metric in conf.last_metrics:
+            # produced by 2 batch servers
+            producers = ['batch1', 'batch2']
+        else:
+            producers = ["cn%d" % (node) for node in range(nodes)]
+        for node in producers:
+            values = [[timestamp, random.random() * 100]
+                      for timestamp in timestamps]
+            series.append((metric, node, values))
+    return series
+
+
+def run(aggregator_cls, series):
+
+    start = time.time()
+    aggregator = aggregator_cls(metrics, conf.last_metrics)
+    for serie in series:
+        aggregator.add(*serie)
+    aggregator.results()
+    return time.time() - start
+
+
+def main():
+
+    points = 360
+    if len(sys.argv) > 1:
+        points = int(sys.argv[1])
+
+    print("%8s %8s %12s %12s %8s" %
+          ('nodes', 'points', 'python (s)', 'numpy (s)', 'speedup'))
+    for nodes in [10, 100, 1000]:
+        series = gen_series(nodes, points)
+        python_time = min(run(PythonAggregator, series) for _ in range(3))
+        numpy_time = min(run(NumpyAggregator, series) for _ in range(3))
+        print("%8d %8d %12.4f %12.4f %7.1fx" %
+              (nodes, points, python_time, numpy_time,
+               python_time / numpy_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Fake slurm-web and InfluxDB services for the end-to-end benchmarks of the
+   REST API, serving synthetic data without any real cluster.
+
+   The number of nodes of a job is given by its ID: job N*1000000+I has N
+   nodes named cn[1-N], whatever I is. This way, the load driver can send
+   requests on many distinct jobs of the same size. The current jobs listed
+   by the fake slurm-web are the jobs with I from 1 to current_jobs for every
+   size of job_sizes.
+
+   The fake InfluxDB parses the queries sent by the REST API, its three query
+   plans (nodes, sharded and pushdown) and the batch queries of many jobs are
+   supported. It generates one series per node and metric, or per job and
+   metric for the batch queries, with the points of the time buckets
+   requested.
+
+   Usage: python bench/fakes.py [--slurm-port PORT] [--influxdb-port PORT]
+"""
+
+import re
+import json
+import time
+import logging
+import argparse
+import threading
+
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
+
+job_factor = 1000000
+# duration of the jobs in seconds
+job_duration = 86400
+# sizes of the current jobs and number of current jobs of every size
+job_sizes = [1, 16, 256, 1024, 4096]
+current_jobs = 256
+
+# metrics with one series reported by a batch server instead of the nodes
+last_metrics = ['cpus', 'nodes']
+# metrics of the CUDA plugin, not tagged with the job
+cuda_metrics = ['utilization_gpu', 'utilization_memory']
+
+
+def job_nodes(jobid):
+    """Returns the number of nodes of the job."""
+
+    return max(jobid // job_factor, 1)
+
+
+def create_slurm_app(latency=0):
+
+    app = Flask('fake-slurm')
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        return json.dumps({'id_token': 'bench'})
+
+    def params(jobid, now):
+        return {'job_state': 'RUNNING',
+                'nodes': "cn[1-%d]" % (job_nodes(jobid)),
+                'start_time': now - job_duration,
+                'end_time': now + 3600,
+                'shared': 0}
+
+    @app.route('/job/<int:jobid>')
+    def job(jobid):
+        time.sleep(latency)
+        return json.dumps(params(jobid, int(time.time())))
+
+    @app.route('/jobs')
+    def jobs():
+        time.sleep(latency)
+        now = int(time.time())
+        return json.dumps({str(jobid): params(jobid, now)
+                           for size in job_sizes
+                           for jobid in range(size * job_factor + 1,
+                                              size * job_factor
+                                              + current_jobs + 1)})
+
+    return app
+
+
+class Statement(object):
+
+    """Parsed InfluxDB statement sent by the REST API."""
+
+    def __init__(self, statement):
+
+        self.pushdown = re.match(r'\s*select (sum|max)\("mean"\)',
+                                 statement) is not None
+        self.producers = 'count(value)' in statement
+        if self.pushdown:
+            self.metrics = re.findall(r'from \(select mean\(value\) from '
+                                      r'"([^"]+)"', statement)
+        else:
+            self.metrics = re.findall(r'"([^"]+)"',
+                                      statement.split(' where ')[0])
+        # The statements select the metrics tagged with the job, the metrics
+        # of the CUDA plugin on the nodes of the job or both. The batch
+        # statements select the metrics tagged with any of the jobs.
+        job = re.search(r"job = 'job_(\d+)'", statement)
+        self.jobid = int(job.group(1)) if job is not None else None
+        jobs = re.search(r"job =~ /\^job_\((.*?)\)\$/", statement)
+        if jobs is not None:
+            self.jobids = [int(jobid) for jobid in jobs.group(1).split('|')]
+        else:
+            self.jobids = None
+        self.cuda = "plugin = 'cuda'" in statement
+        self.start = int(re.search(r'time >= (\d+)000000000',
+                                   statement).group(1))
+        self.end = int(re.search(r'time <= (\d+)000000000',
+                                 statement).group(1))
+        intervals = re.findall(r'time\((\d+)s\)', statement)
+        self.interval = int(intervals[-1]) if intervals else None
+        since = re.search(r'time >= (\d+)ms', statement)
+        self.since = int(since.group(1)) if since else None
+        shard = re.search(r'\)\) (?:and time >= \d+ms )?'
+                          r'and node =~ /\^\((.*?)\)\$/', statement)
+        cuda_nodes = re.search(r"plugin = 'cuda' and node =~ /\^\((.*?)\)\$/",
+                               statement)
+        if self.jobids is not None:
+            self.nodes = []
+        elif shard is not None:
+            self.nodes = [node.replace('\\', '')
+                          for node in shard.group(1).split('|')]
+        elif self.jobid is None:
+            self.nodes = [node.replace('\\', '')
+                          for node in cuda_nodes.group(1).split('|')]
+        else:
+            self.nodes = ["cn%d" % (idx)
+                          for idx in range(1, job_nodes(self.jobid) + 1)]
+
+    def selects(self, metric):
+        """Returns True if the series of the metric are selected by the
+           conditions of the statement."""
+
+        if metric in cuda_metrics:
+            return self.cuda
+        return self.jobid is not None or self.jobids is not None
+
+    def timestamps(self):
+        """Returns the list of timestamps in ms of the time buckets."""
+
+        first = self.start // self.interval * self.interval
+        timestamps = [ts * 1000
+                      for ts in range(first, self.end + 1, self.interval)]
+        if self.since is not None:
+            timestamps = [ts for ts in timestamps if ts >= self.since]
+        return timestamps
+
+    def series(self):
+        """Generator of the JSON encoded series of the statement."""
+
+        if self.producers:
+            for metric in self.metrics:
+                if metric in last_metrics or not self.selects(metric):
+                    continue
+                for node in self.nodes:
+                    yield json.dumps({'name': metric,
+                                      'tags': {'node': node},
+                                      'columns': ['time', 'count'],
+                                      'values': [[0, 1]]})
+            return
+
+        timestamps = self.timestamps()
+        for (idx, metric) in enumerate(self.metrics):
+            if not self.selects(metric):
+                continue
+            # The values are the same for all nodes and jobs so that they are
+            # encoded once per metric, only the tags are encoded per series.
+            values = json.dumps([[ts, float((ts // 1000 + idx) % 100)]
+                                 for ts in timestamps])
+            if self.jobids is not None:
+                tags_list = [{'job': "job_%d" % (jobid)}
+                             for jobid in self.jobids]
+            elif self.pushdown:
+                tags_list = [{}]
+            elif metric in last_metrics:
+                tags_list = [{'node': 'batch'}]
+            else:
+                tags_list = [{'node': node} for node in self.nodes]
+            for tags in tags_list:
+                yield '{"name": %s, "tags": %s, ' \
+                      '"columns": ["time", "mean"], "values": %s}' \
+                      % (json.dumps(metric), json.dumps(tags), values)
+
+
+def create_influxdb_app(latency=0):
+
+    app = Flask('fake-influxdb')
+
+    @app.route('/query', methods=['GET', 'POST'])
+    def query():
+        time.sleep(latency)
+        statements = [Statement(statement)
+                      for statement in request.values['q'].split(';')
+                      if statement.strip()]
+
+        if request.values.get('chunked') == 'true':
+            # one JSON document per series
+            def chunks():
+                for (idx, statement) in enumerate(statements):
+                    for serie in statement.series():
+                        yield '{"results": [{"statement_id": %d, ' \
+                              '"series": [%s]}]}\n' % (idx, serie)
+            return Response(chunks(), mimetype='application/json')
+
+        def document():
+            yield '{"results": ['
+            for (idx, statement) in enumerate(statements):
+                if idx:
+                    yield ', '
+                yield '{"statement_id": %d, "series": [' % (idx)
+                for (nb, serie) in enumerate(statement.series()):
+                    if nb:
+                        yield ', '
+                    yield serie
+                yield ']}'
+            yield ']}'
+        return Response(document(), mimetype='application/json')
+
+    return app
+
+
+def serve(app, port):
+    """Serve the app on the port in a daemon thread, returns the server."""
+
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--slurm-port', type=int, default=18081)
+    parser.add_argument('--influxdb-port', type=int, default=18086)
+    parser.add_argument('--latency', type=float, default=0,
+                        help="delay in seconds of every response")
+    args = parser.parse_args()
+
+    # do not log every request
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    serve(create_slurm_app(args.latency), args.slurm_port)
+    serve(create_influxdb_app(args.latency), args.influxdb_port)
+    while True:
+        time.sleep(3600)
+
+
+if __name__ == '__main__':
+    main()
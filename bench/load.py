@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""End-to-end benchmark of the /metrics endpoints of the REST API against the
+   fake slurm-web and InfluxDB services of bench/fakes.py.
+
+   For every job size, a new REST API server is started and loaded with
+   requests on distinct jobs of this size by concurrent clients, either on
+   the metrics of one job (job endpoint) or on the metrics of batch_size
+   current jobs (batch endpoint). The latency percentiles, the throughput
+   and the peak RSS of the server are reported for every endpoint, job size
+   and concurrency and saved in a JSON file. Results of a previous run can
+   be given as baseline to compare with.
+
+   With a prefetch interval, the params of the current jobs are prefetched by
+   the server and the requests of the job endpoint are sent on the current
+   jobs so that their params are found in cache.
+
+   Usage: python bench/load.py [--nodes 1,16,256,1024,4096]
+                               [--concurrency 1,4,16,64]
+                               [--endpoints job,batch] [--output FILE]
+                               [--baseline FILE] [...]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import itertools
+import subprocess
+
+import requests
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, bench_dir)
+
+from fakes import job_factor, current_jobs
+
+conf_tpl = """[global]
+cache = {tmpdir}/cache.data
+log = {tmpdir}/jobmetrics.log
+archive =
+max_points = {points}
+prefetch_interval = {prefetch_interval}
+
+[influxdb]
+server = http://127.0.0.1:{influxdb_port}
+plan = {plan}
+shard_size = {shard_size}
+
+[bench]
+api = http://127.0.0.1:{slurm_port}
+login = guest
+"""
+
+
+def int_list(value):
+
+    return [int(item) for item in value.split(',')]
+
+
+def endpoint_list(value):
+
+    endpoints = value.split(',')
+    for endpoint in endpoints:
+        if endpoint not in ['job', 'batch']:
+            raise argparse.ArgumentTypeError("invalid endpoint %s"
+                                             % (endpoint))
+    return endpoints
+
+
+def wait_port(port, process, timeout=30):
+    """Wait for the process to listen on the port."""
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("process exited with code %d"
+                               % (process.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise RuntimeError("timeout while waiting for port %d" % (port))
+
+
+def peak_rss(pid):
+    """Returns the peak resident set size of the process in KiB."""
+
+    with open("/proc/%d/status" % (pid)) as status_f:
+        for line in status_f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return None
+
+
+def reset_peak_rss(pid):
+    """Reset the peak RSS of the process to its current RSS, silently ignored
+       on kernels that do not support it."""
+
+    try:
+        with open("/proc/%d/clear_refs" % (pid), 'w') as refs_f:
+            refs_f.write('5')
+    except IOError:
+        pass
+
+
+def percentile(values, percent):
+    """Returns the percentile of the sorted list of values with the nearest
+       rank method."""
+
+    if not values:
+        return None
+    rank = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class LoadDriver(object):
+
+    def __init__(self, url, period, fmt, batch_size, prefetch):
+
+        self.url = url
+        self.period = period
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.prefetch = prefetch
+        # sequence of distinct jobs for every request
+        self.seq = itertools.count(0)
+        self.lock = threading.Lock()
+
+    def jobids(self, nodes, count, current):
+        """Returns the IDs of the count next jobs of the given number of
+           nodes, among the current jobs if current is True."""
+
+        with self.lock:
+            indexes = [next(self.seq) for _ in range(count)]
+        if current:
+            indexes = [index % current_jobs for index in indexes]
+        return [nodes * job_factor + index + 1 for index in indexes]
+
+    def request(self, session, endpoint, nodes):
+        """Send one request on the endpoint with new jobs of the given number
+           of nodes, returns the latency in seconds and True if
+           successful."""
+
+        if endpoint == 'batch':
+            jobids = self.jobids(nodes, self.batch_size, True)
+            url = "{url}/metrics/bench".format(url=self.url)
+            params = {'jobs': ','.join([str(jobid) for jobid in jobids]),
+                      'period': self.period}
+        else:
+            (jobid,) = self.jobids(nodes, 1, self.prefetch)
+            url = "{url}/metrics/bench/{job}/{period}" \
+                  .format(url=self.url, job=jobid, period=self.period)
+            params = {'format': self.fmt}
+        start = time.time()
+        try:
+            resp = session.get(url, params=params)
+            success = resp.status_code == 200
+        except requests.exceptions.RequestException:
+            success = False
+        return (time.time() - start, success)
+
+    def run(self, endpoint, nodes, concurrency, nb_requests):
+        """Send nb_requests requests on the endpoint with concurrency clients
+           and returns the statistics of the run."""
+
+        latencies = []
+        errors = [0]
+        remaining = [nb_requests]
+        lock = threading.Lock()
+
+        def client():
+            session = requests.Session()
+            while True:
+                with lock:
+                    if not remaining[0]:
+                        return
+                    remaining[0] -= 1
+                (latency, success) = self.request(session, endpoint, nodes)
+                with lock:
+                    latencies.append(latency)
+                    if not success:
+                        errors[0] += 1
+
+        clients = [threading.Thread(target=client)
+                   for _ in range(concurrency)]
+        start = time.time()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        duration = time.time() - start
+
+        latencies.sort()
+        return {'endpoint': endpoint,
+                'nodes': nodes,
+                'concurrency': concurrency,
+                'requests': nb_requests,
+                'errors': errors[0],
+                'duration': duration,
+                'throughput': nb_requests / duration,
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99)}
+
+
+def git_revision():
+
+    try:
+        return subprocess.check_output(['git', 'describe', '--always',
+                                        '--dirty'],
+                                       cwd=bench_dir).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print the latencies and throughput of the results relative to the
+       baseline results."""
+
+    with open(baseline_path) as baseline_f:
+        baseline = json.load(baseline_f)
+    # the results of the previous versions are on the job endpoint only
+    points = {(point.get('endpoint', 'job'), point['nodes'],
+               point['concurrency']): point
+              for point in baseline['results']}
+    print("comparison with %s (%s):"
+          % (baseline_path, baseline.get('revision')))
+    for point in results:
+        ref = points.get((point['endpoint'], point['nodes'],
+                          point['concurrency']))
+        if ref is None:
+            continue
+        print("  %-5s nodes %5d concurrency %3d: p50 x%.2f p95 x%.2f "
+              "p99 x%.2f throughput x%.2f rss x%.2f"
+              % (point['endpoint'], point['nodes'], point['concurrency'],
+                 point['p50'] / ref['p50'],
+                 point['p95'] / ref['p95'],
+                 point['p99'] / ref['p99'],
+                 point['throughput'] / ref['throughput'],
+                 float(point['peak_rss']) / ref['peak_rss']))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int_list, default='1,16,256,1024,4096',
+                        help="comma separated list of job sizes")
+    parser.add_argument('--concurrency', type=int_list, default='1,4,16,64',
+                        help="comma separated list of concurrent clients")
+    parser.add_argument('--endpoints', type=endpoint_list, default='job,batch',
+                        help="comma separated list of endpoints among job "
+                             "and batch")
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help="number of jobs per request of the batch "
+                             "endpoint, at most %d" % (current_jobs))
+    parser.add_argument('--prefetch-interval', type=int, default=0,
+                        help="interval in seconds of the prefetch of the "
+                             "current jobs by the server, 0 to disable")
+    parser.add_argument('--requests', type=int, default=32,
+                        help="minimum number of requests per run, at least "
+                             "twice the concurrency")
+    parser.add_argument('--period', default='1h')
+    parser.add_argument('--format', default='rows',
+                        choices=['rows', 'columnar', 'binary'])
+    parser.add_argument('--points', type=int, default=360,
+                        help="max points per metric")
+    parser.add_argument('--plan', default='nodes',
+                        choices=['nodes', 'pushdown'])
+    parser.add_argument('--shard-size', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0,
+                        help="delay in seconds of the fake services")
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--slurm-port', type=int, default=18081)
+    parser.add_argument('--influxdb-port', type=int, default=18086)
+    parser.add_argument('--python', default=sys.executable,
+                        help="interpreter of the REST API server")
+    parser.add_argument('--output', default=None,
+                        help="JSON results file")
+    parser.add_argument('--baseline', default=None,
+                        help="JSON results file of a previous run")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='jobmetrics-bench-')
+    conf_path = os.path.join(tmpdir, 'jobmetrics.conf')
+    with open(conf_path, 'w') as conf_f:
+        conf_f.write(conf_tpl.format(tmpdir=tmpdir,
+                                     points=args.points,
+                                     prefetch_interval=args.prefetch_interval,
+                                     plan=args.plan,
+                                     shard_size=args.shard_size,
+                                     slurm_port=args.slurm_port,
+                                     influxdb_port=args.influxdb_port))
+    env = dict(os.environ, JOBMETRICS_CONF_FILE=conf_path)
+
+    fakes = subprocess.Popen([args.python,
+                              os.path.join(bench_dir, 'fakes.py'),
+                              '--slurm-port', str(args.slurm_port),
+                              '--influxdb-port', str(args.influxdb_port),
+                              '--latency', str(args.latency)])
+    results = []
+    try:
+        wait_port(args.influxdb_port, fakes)
+        driver = LoadDriver("http://127.0.0.1:%d" % (args.port),
+                            args.period, args.format, args.batch_size,
+                            bool(args.prefetch_interval))
+        for nodes in args.nodes:
+            # new server for every job size so that the memory allocated for
+            # the largest jobs does not hide the others
+            server = subprocess.Popen([args.python,
+                                       os.path.join(bench_dir, 'server.py'),
+                                       str(args.port)],
+                                      env=env)
+            try:
+                wait_port(args.port, server)
+                for endpoint in args.endpoints:
+                    # warm up connections pools and tokens
+                    driver.run(endpoint, nodes, 1, 1)
+                    for concurrency in args.concurrency:
+                        reset_peak_rss(server.pid)
+                        result = driver.run(endpoint, nodes, concurrency,
+                                            max(args.requests,
+                                                2 * concurrency))
+                        result['peak_rss'] = peak_rss(server.pid)
+                        results.append(result)
+                        print("%-5s nodes %5d concurrency %3d: p50 %.3fs "
+                              "p95 %.3fs p99 %.3fs %.1f req/s peak rss %d "
+                              "KiB errors %d"
+                              % (endpoint, nodes, concurrency,
+                                 result['p50'], result['p95'],
+                                 result['p99'], result['throughput'],
+                                 result['peak_rss'], result['errors']))
+                        sys.stdout.flush()
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        fakes.terminate()
+        fakes.wait()
+        shutil.rmtree(tmpdir)
+
+    output = args.output
+    if output is None:
+        output = "bench-%s.json" % (time.strftime('%Y%m%d-%H%M%S'))
+    with open(output, 'w') as output_f:
+        json.dump({'revision': git_revision(),
+                   'date': int(time.time()),
+                   'parameters': {'period': args.period,
+                                  'format': args.format,
+                                  'points': args.points,
+                                  'batch_size': args.batch_size,
+                                  'prefetch_interval':
+                                      args.prefetch_interval,
+                                  'plan': args.plan,
+                                  'shard_size': args.shard_size,
+                                  'latency': args.latency},
+                   'results': results},
+                  output_f, indent=2)
+    print("results saved in %s" % (output))
+
+    if args.baseline is not None:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Serve the REST API with the threaded HTTP server of werkzeug for the
+   end-to-end benchmarks, the configuration file is given in the
+   JOBMETRICS_CONF_FILE environment variable.
+
+   Usage: python bench/server.py PORT
+"""
+
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'rest'))
+
+from werkzeug.serving import run_simple
+
+from app import app
+
+
+if __name__ == '__main__':
+    # do not log every request
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)
@@ -0,0 +1,170 @@
+/*
+ * Copyright (C) 2015-2018 EDF SA
+ *
+ * This file is part of jobmetrics.
+ *
+ * jobmetrics is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * jobmetrics is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/*
+ * Fetch and decoding of the metrics of the jobs into typed arrays. This file
+ * runs in a Web Worker to keep this work out of the main thread of the
+ * dashboard. It is also loaded in the page for the browsers without Web
+ * Workers, the dashboard then calls process_message() directly.
+ *
+ * The messages are objects with the identifier of the request (id), its
+ * source ('poll' or 'stream') and either the url of the metrics in binary
+ * format to fetch (url) or the JSON text of a stream event to decode (data).
+ * The replies are batches with the same id and source, the interval, the
+ * reset flag and the debug data, the timestamps in a Float64Array and the
+ * values of every metric in a Float32Array. On failure, the reply has the
+ * HTTP status and the error instead.
+ */
+
+var binary_magic = 'JMB1';
+var binary_mimetype = 'application/vnd.jobmetrics.binary';
+
+function buffer_text(buffer, start, end) {
+
+    var bytes = new Uint8Array(buffer, start, end - start);
+    var text = '';
+    // apply() is limited in the number of arguments, convert by chunks
+    for (var i = 0; i < bytes.length; i += 8192)
+        text += String.fromCharCode.apply(null, bytes.subarray(i, i + 8192));
+    return text;
+
+}
+
+function decode_binary(buffer) {
+
+    var view = new DataView(buffer);
+    if (buffer.byteLength < 8 || buffer_text(buffer, 0, 4) !== binary_magic)
+        throw new Error("invalid binary metrics");
+    var header_length = view.getUint32(4, true);
+    var header = JSON.parse(buffer_text(buffer, 8, 8 + header_length));
+    var count = header['count'];
+    var offset = 8 + header_length;
+
+    var timestamps = new Float64Array(count);
+    for (var i = 0; i < count; i++, offset += 8) {
+        // int64 split in two uint32, timestamps in ms fit in a double
+        timestamps[i] = view.getUint32(offset + 4, true) * 4294967296
+                      + view.getUint32(offset, true);
+    }
+    var columns = [];
+    for (var j = 0; j < header['metrics'].length; j++) {
+        var column = new Float32Array(count);
+        for (var i = 0; i < count; i++, offset += 4)
+            column[i] = view.getFloat32(offset, true);
+        columns.push(column);
+    }
+    return { metrics: header['metrics'],
+             interval: header['interval'],
+             reset: false,
+             debug: header['debug'],
+             timestamps: timestamps,
+             columns: columns };
+
+}
+
+function decode_rows(result) {
+
+    // The stream events contain one list of values per timestamp
+    var data = result['data'];
+    var keys = Object.keys(data).map(Number).sort(function(a, b) {
+        return a - b;
+    });
+    var timestamps = new Float64Array(keys);
+    var columns = [];
+    if (keys.length > 0) {
+        for (var j = 0; j < data[keys[0]].length; j++) {
+            var column = new Float32Array(keys.length);
+            for (var i = 0; i < keys.length; i++) {
+                var value = data[keys[i]][j];
+                column[i] = (value === null) ? NaN : value;
+            }
+            columns.push(column);
+        }
+    }
+    return { metrics: result['metrics'],
+             interval: result['interval'],
+             reset: result['reset'] === true,
+             debug: result['debug'],
+             timestamps: timestamps,
+             columns: columns };
+
+}
+
+function fetch_metrics(url, callback) {
+
+    var xhr = new XMLHttpRequest();
+    xhr.open('GET', url);
+    xhr.responseType = 'arraybuffer';
+    xhr.setRequestHeader('Accept', binary_mimetype);
+    xhr.onload = function() {
+        if (xhr.status !== 200) {
+            var error;
+            try {
+                error = JSON.parse(buffer_text(xhr.response, 0,
+                                               xhr.response.byteLength));
+            } catch (e) {
+                error = { error: xhr.statusText };
+            }
+            callback({ status: xhr.status, error: error });
+            return;
+        }
+        try {
+            callback(decode_binary(xhr.response));
+        } catch (e) {
+            callback({ status: xhr.status, error: { error: e.message } });
+        }
+    };
+    xhr.onerror = function() {
+        callback({ status: xhr.status, error: { error: "request failed" } });
+    };
+    xhr.send();
+
+}
+
+function process_message(message, reply) {
+
+    var done = function(batch) {
+        batch.id = message.id;
+        batch.source = message.source;
+        reply(batch);
+    };
+    if (message.url !== undefined)
+        fetch_metrics(message.url, done);
+    else
+        done(decode_rows(JSON.parse(message.data)));
+
+}
+
+function transferables(batch) {
+
+    if (batch.timestamps === undefined)
+        return [];
+    return [batch.timestamps.buffer].concat(
+        batch.columns.map(function(column) { return column.buffer; }));
+
+}
+
+if (typeof window === 'undefined') {
+    self.onmessage = function(event) {
+        process_message(event.data, function(batch) {
+            // the arrays are moved to the main thread, not copied
+            self.postMessage(batch, transferables(batch));
+        });
+    };
+}
@@ -24,6 +24,9 @@ var plot = null;
 var debug = false;
 var updateInterval = 10 * 1000; // 10 seconds
 var update_timeout = null;
+var plot_options = null;
+var stream = null; // EventSource of the metrics stream, if supported
+var stream_failed = false; // fall back to polling when the stream fails
 
 function getUrlParameter(sParam) {
     var sPageURL = decodeURIComponent(window.location.search.substring(1)),
@@ -40,44 +43,32 @@ function getUrlParameter(sParam) {
     }
 };
 
-function process_metrics_result(result) {
-
-    var cpu_user = new Array;
-    var cpu_system = new Array;
-    var cpu_idle = new Array;
-    var cpu_iowait = new Array;
-    var cpu_softirq = new Array;
-    var gpu_scale_max = 0;
-    var cpu_scale_max = 0;
-    var memory_pss = new Array;
-    var memory_rss = new Array;
-    var utilization_gpu = new Array;
-    var utilization_memory = new Array;
-    var plots = new Array();
-    var utc_offset_msec = new Date().getTimezoneOffset() * 60 * 1000;
-
-    $.each(result, function( timestamp_utc, values ) {
-	if (values[7] > gpu_scale_max)
-		gpu_scale_max=values[7];
-	if (values[9] > cpu_scale_max)
-		cpu_scale_max=values[9];
-    });   
-
-    $.each(result, function( timestamp_utc, values ) {
-        var timestamp = parseInt(timestamp_utc) - utc_offset_msec;
-        cpu_system.push([timestamp, values[0]/cpu_scale_max]);
-        cpu_iowait.push([timestamp, values[1]/cpu_scale_max]);
-        cpu_user.push([timestamp, values[2]/cpu_scale_max]);
-        cpu_softirq.push([timestamp, values[3]/cpu_scale_max]);
-        cpu_idle.push([timestamp, values[4]/cpu_scale_max]);
-        memory_pss.push([timestamp, values[5]/(1024*1024*1024)]);
-        memory_rss.push([timestamp, values[6]/(1024*1024*1024)]);
-	utilization_gpu.push([timestamp, values[7]*100/gpu_scale_max]);
-        utilization_memory.push([timestamp, values[8]]);
-    });
-    
-    plots = [
-        { data: cpu_system,
+// Durations of the periods in ms, used to drop the points that go out of the
+// window when new points are appended. The job period covers the whole job.
+var period_durations = {
+    '1h': 3600 * 1000,
+    '6h': 6 * 3600 * 1000,
+    '24h': 24 * 3600 * 1000,
+    'job': null
+};
+var utc_offset_msec = new Date().getTimezoneOffset() * 60 * 1000;
+var ring = null; // ring buffers of the metrics received so far
+var interval = null; // interval in seconds between the points
+var plots = null; // Flot series, decimated from the ring on every refresh
+var gpu_scale_max = 0;
+var cpu_scale_max = 0;
+var worker = null; // Web Worker decoding the metrics, if supported
+var sequence = 0; // identifier of the current request or stream
+
+function init_plots() {
+
+    // For each serie, metric is the name of the metric of its values and
+    // scale is the transformation applied to the value to get the plotted
+    // point.
+    var plots = [
+        { data: [],
+          metric: 'cpu-system',
+          scale: 'cpu',
           color: "rgba(204,0,0,1)",
           label: "CPU system %",
           stack: true,
@@ -86,7 +77,9 @@ function process_metrics_result(result) {
             fill: true,
           }
         },
-        { data: cpu_iowait,
+        { data: [],
+          metric: 'cpu-iowait',
+          scale: 'cpu',
           color: "rgba(255,204,0,1)",
           label: "CPU I/O wait %",
           stack: true,
@@ -95,7 +88,9 @@ function process_metrics_result(result) {
             fill: true,
           }
         },
-        { data: cpu_user,
+        { data: [],
+          metric: 'cpu-user',
+          scale: 'cpu',
           color: "rgba(204,153,255,1)",
           label: "CPU user %",
           stack: true,
@@ -104,7 +99,9 @@ function process_metrics_result(result) {
             fill: true,
           }
         },
-        { data: cpu_softirq,
+        { data: [],
+          metric: 'cpu-softirq',
+          scale: 'cpu',
           color: "rgba(104,153,255,1)",
           label: "CPU softirq %",
           stack: true,
@@ -113,7 +110,9 @@ function process_metrics_result(result) {
             fill: true,
           }
         },
-        { data: cpu_idle,
+        { data: [],
+          metric: 'cpu-idle',
+          scale: 'cpu',
           color: "rgba(115,210,22,1)",
           label: "CPU idle %",
           stack: true,
@@ -124,8 +123,10 @@ function process_metrics_result(result) {
         },
     ];
     if (!hide_pss) {
-	plots.push(
-            { data: memory_pss,
+        plots.push(
+            { data: [],
+              metric: 'memory-pss',
+              scale: 'gib',
               color: "rgba(52,101,164,1)",
               label: "GiB memory (PSS)",
               yaxis: 2
@@ -133,20 +134,26 @@ function process_metrics_result(result) {
         );
     }
     if (!hide_rss) {
-	plots.push(
-            { data: memory_rss,
+        plots.push(
+            { data: [],
+              metric: 'memory-rss',
+              scale: 'gib',
               color: "rgba(26,198,224,1)",
               label: "GiB memory (RSS)",
               yaxis: 2
             }
-	);
+        );
     }
     plots.push(
-	    { data: utilization_gpu,
-	      color: "rgba(52,1,164,1)",
+            { data: [],
+              metric: 'utilization_gpu',
+              scale: 'gpu',
+              color: "rgba(52,1,164,1)",
               label: "GPU %",
             },
-            { data: utilization_memory,
+            { data: [],
+              metric: 'utilization_memory',
+              scale: 'none',
               color: "rgba(152,1,64,1)",
               label: "GPU Memory %",
             }
@@ -155,17 +162,195 @@ function process_metrics_result(result) {
 
 }
 
+function scale(serie, value) {
+
+    // without the number of cpus, the sum over all cpus is plotted
+    if (serie.scale === 'cpu')
+        return cpu_scale_max > 0 ? value / cpu_scale_max : value;
+    else if (serie.scale === 'gib')
+        return value / (1024*1024*1024);
+    else if (serie.scale === 'gpu')
+        return value * 100 / gpu_scale_max;
+    return value;
+
+}
+
+function reset_metrics() {
+
+    ring = null;
+    interval = null;
+    plots = null;
+    gpu_scale_max = 0;
+    cpu_scale_max = 0;
+
+}
+
+// The points are stored in ring buffers: the timestamps in a Float64Array
+// and the values of every metric in a Float32Array. The oldest points are
+// dropped by moving the start of the ring, the buffers are only reallocated
+// when the window holds more points than their capacity.
+function init_ring(metrics, capacity) {
+
+    var columns = [];
+    for (var j = 0; j < metrics.length; j++)
+        columns.push(new Float32Array(capacity));
+    return { start: 0,
+             length: 0,
+             capacity: capacity,
+             metrics: metrics,
+             timestamps: new Float64Array(capacity),
+             columns: columns };
+
+}
+
+function ring_index(i) {
+
+    return (ring.start + i) % ring.capacity;
+
+}
+
+function grow_ring() {
+
+    var larger = init_ring(ring.metrics, ring.capacity * 2);
+    for (var i = 0; i < ring.length; i++) {
+        var k = ring_index(i);
+        larger.timestamps[i] = ring.timestamps[k];
+        for (var j = 0; j < ring.columns.length; j++)
+            larger.columns[j][i] = ring.columns[j][k];
+    }
+    larger.length = ring.length;
+    ring = larger;
+
+}
+
+function last_timestamp() {
+
+    if (ring === null || ring.length === 0)
+        return null;
+    return ring.timestamps[ring_index(ring.length - 1)];
+
+}
+
+function column(batch, metric) {
+
+    // The columns of the metrics are named, some metrics are possibly not
+    // collected on the cluster.
+    var index = batch.metrics.indexOf(metric);
+    return (index === -1) ? null : batch.columns[index];
+
+}
+
+function append_batch(batch) {
+
+    var count = batch.timestamps.length;
+    var gpus = column(batch, 'utilization_gpu');
+    var cpus = column(batch, 'cpus');
+
+    if (count === 0)
+        return;
+    if (ring !== null && ring.metrics.join() !== batch.metrics.join())
+        ring = null;
+    if (ring === null)
+        ring = init_ring(batch.metrics, Math.max(512, count));
+
+    // The batch starts with the last bucket received previously since it
+    // was possibly incomplete. Replace it with its new values.
+    while (ring.length > 0 && last_timestamp() >= batch.timestamps[0])
+        ring.length--;
+
+    for (var i = 0; i < count; i++) {
+        if (ring.length === ring.capacity)
+            grow_ring();
+        var k = ring_index(ring.length);
+        ring.timestamps[k] = batch.timestamps[i];
+        for (var j = 0; j < batch.columns.length; j++)
+            ring.columns[j][k] = batch.columns[j][i];
+        ring.length++;
+        if (gpus !== null && gpus[i] > gpu_scale_max)
+            gpu_scale_max = gpus[i];
+        if (cpus !== null && cpus[i] > cpu_scale_max)
+            cpu_scale_max = cpus[i];
+    }
+
+    // Drop the points that are now out of the period window
+    if (period_durations[period] !== null) {
+        var window_start = last_timestamp() - period_durations[period];
+        while (ring.timestamps[ring.start] < window_start) {
+            ring.start = (ring.start + 1) % ring.capacity;
+            ring.length--;
+        }
+    }
+
+}
+
+// Returns the points of the serie to draw in width pixels. When there are
+// more points than pixels, the points are grouped in one bucket per pixel and
+// each bucket is drawn with its min and max values, in their order, so that
+// the peaks remain visible. The stacked series are drawn with the mean of the
+// bucket instead since their values are summed.
+function decimate(serie, width) {
+
+    var values = column(ring, serie.metric);
+    var count = ring.length;
+    var data = [];
+
+    if (values === null)
+        return data;
+    if (count <= 2 * width) {
+        for (var i = 0; i < count; i++) {
+            var k = ring_index(i);
+            data.push([ring.timestamps[k] - utc_offset_msec,
+                       scale(serie, values[k])]);
+        }
+        return data;
+    }
+
+    for (var b = 0; b < width; b++) {
+        var first = Math.floor(b * count / width);
+        var last = Math.floor((b + 1) * count / width) - 1;
+        var min = Infinity, max = -Infinity, i_min = first, i_max = first;
+        var sum = 0, points = 0;
+        for (var i = first; i <= last; i++) {
+            var value = values[ring_index(i)];
+            if (isNaN(value))
+                continue;
+            sum += value;
+            points++;
+            if (value < min) { min = value; i_min = i; }
+            if (value > max) { max = value; i_max = i; }
+        }
+        var x_first = ring.timestamps[ring_index(first)] - utc_offset_msec;
+        var x_last = ring.timestamps[ring_index(last)] - utc_offset_msec;
+        if (points === 0) {
+            data.push([x_first, null], [x_last, null]);
+        } else if (serie.stack) {
+            var mean = scale(serie, sum / points);
+            data.push([x_first, mean], [x_last, mean]);
+        } else if (i_min <= i_max) {
+            data.push([x_first, scale(serie, min)],
+                      [x_last, scale(serie, max)]);
+        } else {
+            data.push([x_first, scale(serie, max)],
+                      [x_last, scale(serie, min)]);
+        }
+    }
+    return data;
+
+}
+
 
 function set_period(new_period) {
     console.log("period is: " + new_period);
     period = new_period;
-    update();
+    reset_metrics();
+    update(plot_options);
 }
 
 function init_period_links() {
     $('#period-1h').click(function(){ set_period('1h'); return false; });
     $('#period-6h').click(function(){ set_period('6h'); return false; });
     $('#period-24h').click(function(){ set_period('24h'); return false; });
+    $('#period-job').click(function(){ set_period('job'); return false; });
 }
 
 function init_debug_zone() {
@@ -208,50 +393,181 @@ function show_error(status, error) {
     $box.show();
 }
 
+function init_plot(options) {
+
+    // initialize on first call if null
+    plot = $.plot("#placeholder", [], options);
+
+    // Add labels to both Y-axis. Their absolute positions are
+    // calculated based on their width with combination of
+    // top/margin-top to set their height. They are also 'transformed'
+    // in the CSS to rotate them by 90 or -90°.
+    var yaxis_cpu_label = $("<div class='axisLabel yaxisLabel yaxis1Label'></div>")
+                          .text("CPU/GPU usage & GPU Memory (%)")
+                          .appendTo("#placeholder");
+
+    yaxis_cpu_label.css("margin-top", yaxis_cpu_label.width() / 2);
+    yaxis_cpu_label.css("left", "-8px");
+
+    var yaxis_mem_label = $("<div class='axisLabel yaxisLabel yaxis2Label'></div>")
+                          .text("Memory consumption (GiB)")
+                          .appendTo("#placeholder");
+
+    yaxis_mem_label.css("margin-top", -yaxis_mem_label.width() / 2);
+    yaxis_mem_label.css("right", -yaxis_mem_label.width());
+}
+
+function draw_batch(batch, options) {
+
+    if (plot === null)
+        init_plot(options);
+    if (plots === null)
+        plots = init_plots();
+    interval = batch.interval;
+    append_batch(batch);
+    // The number of points given to Flot is bounded by the width of the
+    // canvas, whatever the number of points in the window.
+    var width = Math.max(plot.width(), 1);
+    if (ring !== null) {
+        $.each(plots, function(i, serie) {
+            serie.data = decimate(serie, width);
+        });
+    }
+    // the series of the metrics not collected on the cluster are hidden
+    plot.setData($.grep(plots, function(serie) {
+        return ring === null || ring.metrics.indexOf(serie.metric) !== -1;
+    }));
+    plot.setupGrid();
+    plot.draw();
+    if (batch.debug !== undefined && batch.debug !== null)
+        update_debug_modal(batch.debug);
+}
+
+function requested_metrics() {
+
+    // Only the metrics of the plotted series are requested, with the number
+    // of cpus to scale the cpu usages.
+    var metrics = $.map(init_plots(), function(serie) {
+        return serie.metric;
+    });
+    metrics.push('cpus');
+    return metrics.join(',');
+
+}
+
+function decode(message) {
+
+    // The worker replies asynchronously, the replies to the requests and
+    // the streams replaced since then are ignored thanks to their id.
+    message.id = sequence;
+    if (worker !== null)
+        worker.postMessage(message);
+    else
+        setTimeout(function() {
+            process_message(message, receive);
+          }, 0);
+
+}
+
+function receive(batch) {
+
+    if (batch.id !== sequence)
+        return;
+    if (batch.error !== undefined) {
+        show_error(batch.status, batch.error);
+        return;
+    }
+    if (batch.source === 'stream') {
+        if (batch.reset)
+            reset_metrics();
+        draw_batch(batch, plot_options);
+        return;
+    }
+    // The interval between the points is adapted to the length of the
+    // job. When it changes, all the points are received again.
+    if (interval !== null && batch.interval !== interval) {
+        reset_metrics();
+        update(plot_options);
+        return;
+    }
+    draw_batch(batch, plot_options);
+    update_timeout = setTimeout(function() {
+        update(plot_options);
+      }, updateInterval);
+
+}
+
 function update(options) {
 
     if (update_timeout != null)
         clearTimeout(update_timeout);
+    if (stream !== null) {
+        stream.close();
+        stream = null;
+    }
+    sequence++;
+    if (window.EventSource !== undefined && !stream_failed) {
+        subscribe(options);
+        return;
+    }
     base_api = "/jobmetrics-restapi"
-    api = base_api + "/metrics/" + cluster + "/" + job + "/" + period;
-    $.ajax({
-        url: api,
-        dataType: "json" })
-      .done( function(result){
-        if (plot === null) {
-            // initialize on first call if null
-            plot = $.plot("#placeholder", process_metrics_result(result), options);
-
-            // Add labels to both Y-axis. Their absolute positions are
-            // calculated based on their width with combination of
-            // top/margin-top to set their height. They are also 'transformed'
-            // in the CSS to rotate them by 90 or -90°.
-            var yaxis_cpu_label = $("<div class='axisLabel yaxisLabel yaxis1Label'></div>")
-                                  .text("CPU/GPU usage & GPU Memory (%)")
-                                  .appendTo("#placeholder");
-
-            yaxis_cpu_label.css("margin-top", yaxis_cpu_label.width() / 2);
-            yaxis_cpu_label.css("left", "-8px");
-
-            var yaxis_mem_label = $("<div class='axisLabel yaxisLabel yaxis2Label'></div>")
-                                  .text("Memory consumption (GiB)")
-                                  .appendTo("#placeholder");
-
-            yaxis_mem_label.css("margin-top", -yaxis_mem_label.width() / 2);
-            yaxis_mem_label.css("right", -yaxis_mem_label.width());
-        }
-        plot.setData(process_metrics_result(result['data']));
-        // Since the axes don't change, we don't need to call plot.setupGrid()
-        plot.setupGrid();
-        plot.draw();
-        update_timeout = setTimeout(function() {
+    api = base_api + "/metrics/" + cluster + "/" + job + "/" + period
+        + "?format=binary&metrics=" + requested_metrics();
+    // Only request the buckets since the last one received, it is sent
+    // again since it was possibly incomplete.
+    if (last_timestamp() !== null)
+        api += "&since=" + last_timestamp();
+    decode({ source: 'poll', url: api });
+
+}
+
+function subscribe(options) {
+
+    // The server pushes the new buckets of the job as they come. The first
+    // event, and the first one after a change of interval or a reconnection,
+    // contains all the buckets of the window.
+    var received = false;
+    api = "/jobmetrics-restapi/stream/" + cluster + "/" + job + "/" + period
+        + "?metrics=" + requested_metrics();
+    stream = new EventSource(api);
+    stream.addEventListener('metrics', function(event) {
+        received = true;
+        decode({ source: 'stream', data: event.data });
+    });
+    stream.addEventListener('end', function(event) {
+        // The job is over, all its metrics have been received.
+        stream.close();
+        stream = null;
+        var result = JSON.parse(event.data);
+        if (result['error'] !== undefined)
+            show_error(404, result);
+    });
+    stream.onerror = function() {
+        // The browser reconnects by itself once the stream has worked,
+        // otherwise the stream is not available and polling is used.
+        if (!received) {
+            stream.close();
+            stream = null;
+            stream_failed = true;
             update(options);
-          }, updateInterval);
-        update_debug_modal(result['debug']);
-      })
-      .fail( function(jqXHR, textStatus, errorThrown) {
-        show_error(jqXHR.status, $.parseJSON(jqXHR.responseText));
-      });
+        }
+    };
+}
+
+function init_worker() {
+
+    if (window.Worker === undefined)
+        return;
+    worker = new Worker('js/jobmetrics-worker.js');
+    worker.onmessage = function(event) {
+        receive(event.data);
+    };
+    worker.onerror = function(event) {
+        // decode the metrics in the page from now on
+        worker.terminate();
+        worker = null;
+        update(plot_options);
+    };
 
 }
 
@@ -275,9 +591,10 @@ function draw_diagram() {
 
     init_period_links();
     init_debug_zone();
+    init_worker();
     set_title(cluster, job);
 
-    var options = {
+    plot_options = {
         grid: {
           labelMargin: 10,
           margin: {
@@ -310,6 +627,6 @@ function draw_diagram() {
         }
     };
 
-    update(options);
+    update(plot_options);
 
 }
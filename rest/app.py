@@ -19,99 +19,197 @@
 # along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from flask import Flask, jsonify, abort, request
+from flask import Flask, Blueprint, Response, current_app, jsonify, abort, \
+                  request
 from requests.exceptions import ConnectionError
 
 import os
+import json
+import gzip
+import Queue
+import hashlib
+from StringIO import StringIO
 
-import logging
-from logging.handlers import TimedRotatingFileHandler
-from logging import Formatter
-
-from jobmetrics.Conf import Conf, periods
-from jobmetrics.Cache import Cache
-from jobmetrics.SlurmAPI import SlurmAPI
-from jobmetrics.MetricsDB import MetricsDB
+from jobmetrics.Conf import periods, default_path
+from jobmetrics.AppContext import AppContext
 from jobmetrics.JobParams import JobParams
 from jobmetrics.JobData import JobData
+from jobmetrics.JobsBatch import JobsBatch
 from jobmetrics.Profiler import Profiler
+from jobmetrics.NodesMatrix import np
+from jobmetrics import Formats
+from jobmetrics.Summary import summarize
 
 
-app = Flask('jobmetrics')
-# By default flask redirects "metrics/CLUSTER/JOB/1h" to
-# "metrics/CLUSTER/JOB" since 1h is the default. This is nice on
-# a browser but the JS client doesn't like it
-app.url_map.redirect_defaults = False
+api = Blueprint('jobmetrics', __name__)
 
 
-@app.errorhandler(500)
+@api.app_errorhandler(500)
 def internal_error(error):
     if not hasattr(error, 'description'):
         error.description = {'error': 'unknown internal error'}
-    app.logger.error("error 500: %s", error.description['error'])
-    app.logger.exception(error)
+    current_app.logger.error("error 500: %s", error.description['error'])
+    current_app.logger.exception(error)
     response = jsonify(error.description)
     response.status_code = 500
     return response
 
 
-@app.errorhandler(404)
+@api.app_errorhandler(400)
+def bad_request(error):
+    current_app.logger.error("error 400: %s", error.description['error'])
+    response = jsonify(error.description)
+    response.status_code = 400
+    return response
+
+
+@api.app_errorhandler(404)
 def page_not_found(error):
-    app.logger.error("error 404: %s", error.description['error'])
+    current_app.logger.error("error 404: %s", error.description['error'])
     response = jsonify(error.description)
     response.status_code = 404
     return response
 
 
-def init_logger(conf):
+@api.app_errorhandler(503)
+def service_unavailable(error):
+    current_app.logger.warning("error 503: %s", error.description['error'])
+    response = jsonify(error.description)
+    response.status_code = 503
+    return response
 
-    log_h = TimedRotatingFileHandler(conf.log_path,
-                                     when='D',
-                                     interval=1,
-                                     backupCount=10)
-    if conf.debug:
-        log_h.setLevel(logging.DEBUG)
-    else:
-        log_h.setLevel(logging.INFO)
-    log_h.setFormatter(Formatter(
-        '%(asctime)s %(filename)s:%(lineno)d %(levelname)s: %(message)s'))
-
-    # Remove all other handlers and disable propagation to ancestor logger in
-    # order to avoid polluting HTTP server error log with app specific logs.
-    app.logger.propagate = False
-    app.logger.handlers = []
-    app.logger.addHandler(log_h)
-    if conf.debug:
-        app.logger.setLevel(logging.DEBUG)
-    else:
-        app.logger.setLevel(logging.INFO)
 
+@api.before_request
+def init_profiler():
+    # Every request starts with a new Profiler for its thread.
+    Profiler.reset()
+    Profiler().start('request')
+
+
+@api.after_request
+def record_stats(response):
+    profiler = Profiler()
+    profiler.stop('request')
+    cluster = (request.view_args or {}).get('cluster')
+    if cluster is not None:
+        stats = current_app.extensions['jobmetrics'].stats
+        stats.record(cluster, response.status_code,
+                     profiler.dump()['timers'])
+    return response
+
+
+@api.after_request
+def compress(response):
+    # Compress the bodies greater than gzip_threshold when the client accepts
+    # it. The streams are never compressed. The compressed representation
+    # gets its own strong ETag.
+    conf = current_app.extensions['jobmetrics'].conf
+    if conf is None or not conf.gzip_threshold \
+       or response.status_code != 200 \
+       or response.direct_passthrough or response.is_streamed \
+       or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings:
+        return response
+    data = response.get_data()
+    if len(data) < conf.gzip_threshold:
+        return response
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6) as gzip_f:
+        gzip_f.write(data)
+    response.set_data(buf.getvalue())
+    response.headers['Content-Encoding'] = 'gzip'
+    (etag, weak) = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(gzip_etag(etag))
+    return response
+
+
+def gzip_etag(etag):
+    """Returns the strong ETag of the gzip representation of the response
+       whose identity representation has the strong ETag."""
+
+    return etag + '-gzip'
+
+
+def conf_path():
+    """Returns the path to the configuration file, as set in the request
+       environment, or in process environment or the default path."""
 
-@app.route('/metrics/<cluster>/<int:jobid>', defaults={'period': '1h'})
-@app.route('/metrics/<cluster>/<int:jobid>/<period>')
-def metrics(cluster, jobid, period):
     if 'JOBMETRICS_CONF_FILE' in request.environ.keys():
-        conf = Conf(request.environ['JOBMETRICS_CONF_FILE'])
+        return request.environ['JOBMETRICS_CONF_FILE']
     elif 'JOBMETRICS_CONF_FILE' in os.environ.keys():
-        conf = Conf(os.environ.get('JOBMETRICS_CONF_FILE'))
-    else:
-        conf = Conf()
+        return os.environ.get('JOBMETRICS_CONF_FILE')
+    return default_path
 
-    init_logger(conf)
 
-    cache = Cache(conf.cache_path)
-    cluster_cache = cache.get(cluster)
-    slurm_api = SlurmAPI(conf, cluster, cluster_cache)
-    profiler = Profiler()
-    job = JobParams(jobid)
+def app_context():
+    """Returns the AppContext of the current application after having
+       ensured its configuration is up-to-date."""
+
+    ctx = current_app.extensions['jobmetrics']
+    ctx.refresh(conf_path())
+    return ctx
+
+
+def response_format():
+    """Returns the name of the format of the response, selected with the
+       format parameter or negotiated with the Accept header. Defaults to
+       rows format."""
+
+    fmt = request.args.get('format')
+    if fmt is not None:
+        if fmt not in [name for (name, _) in Formats.formats]:
+            abort(500, {'error': "format %s is not valid" % (fmt)})
+        return fmt
+
+    mimetypes = [mimetype for (_, mimetype) in Formats.formats]
+    best = request.accept_mimetypes.best_match(mimetypes,
+                                               default=mimetypes[0])
+    return Formats.formats[mimetypes.index(best)][0]
 
-    app.logger.info("GET cluster %s jobid %d" % (cluster, jobid))
+
+def metrics_etag(job_data, fmt):
+    """Returns the strong ETag of the metrics of the job in the format. It
+       changes with the job state, the timestamp and the values of the last
+       time bucket, which is possibly incomplete, and the number of buckets.
+       The debug data are not taken into account."""
+
+    timestamps = sorted(job_data.metrics.keys(), key=int)
+    last = timestamps[-1] if timestamps else None
+    key = json.dumps([job_data.job.state,
+                      job_data.period,
+                      job_data.since,
+                      fmt,
+                      job_data.metric_names,
+                      job_data.interval,
+                      len(timestamps),
+                      last,
+                      job_data.metrics.get(last)])
+    return hashlib.sha1(key).hexdigest()
+
+
+def metrics_cache_control(job):
+    """Returns the Cache-Control header of the metrics of the job. The
+       metrics of jobs terminated for long enough can not change anymore,
+       the others must be revalidated."""
+
+    if job.settled:
+        return 'public, max-age=31536000, immutable'
+    return 'no-cache'
+
+
+def request_params(ctx, cluster, job):
+    """Request the params of the job, abort with 404 if the job is unknown or
+       500 on other errors."""
 
     try:
-        job.request_params(slurm_api)
+        job.request_params(ctx.slurm_api(cluster), ctx.jobs_cache,
+                           ctx.flights)
     except IndexError as err:
-        # IndexError here means the job is unknown according to Slurm API.
-        # Return 404 with error message
+        # IndexError here means the job is unknown according to Slurm
+        # API. Return 404 with error message
         abort(404, {'error': str(err)})
     except (ValueError, ConnectionError, Exception) as err:
         # ValueError means the Slurm API responded something that was not
@@ -120,23 +218,447 @@ def metrics(cluster, jobid, period):
         abort(500, {'error': err.message})
 
     # Write the cache at this point since it will not be modified then
-    cache.write()
+    ctx.cache.write()
+
+
+def requested_metrics(ctx, cluster):
+    """Returns the list of the metrics of the cluster selected with the
+       comma separated list of the metrics parameter, all the metrics of the
+       cluster by default. The metrics of the registry not collected on the
+       cluster are ignored, abort with 500 if a metric is not in the
+       registry and with 400 if none of the selected metrics is collected on
+       the cluster."""
+
+    try:
+        metrics = ctx.conf.cluster_metrics(cluster)
+    except ValueError as err:
+        abort(500, {'error': str(err)})
+    selected = request.args.get('metrics')
+    if selected is None:
+        return metrics
+    selected = [metric for metric in selected.split(',') if metric]
+    for metric in selected:
+        if metric not in ctx.conf.metrics:
+            abort(500, {'error': "metric %s is not valid" % (metric)})
+    metrics = [metric for metric in metrics if metric in selected]
+    if not metrics:
+        abort(400, {'error': "metrics %s are not collected on cluster %s"
+                             % (', '.join(selected), cluster)})
+    return metrics
+
+
+def nodes_metrics(ctx, cluster):
+    """Returns the list of the metrics of the nodes selected with the metrics
+       parameter, all metrics of the cluster summed over the nodes by
+       default. Abort with 400 if none of them is summed over the nodes."""
+
+    metrics = [metric for metric in requested_metrics(ctx, cluster)
+               if metric not in ctx.conf.last_metrics]
+    if not metrics:
+        abort(400, {'error': "no metric summed over the nodes is selected"})
+    return metrics
+
+
+def request_nodes_matrix(cluster, jobid, period):
+    """Returns the NodesMatrix of the job for the period."""
+
+    ctx = app_context()
+
+    if period not in periods.keys():
+        abort(500, {'error': "period %s is not valid" % (period)})
+    if np is None:
+        abort(500, {'error': "numpy is required for nodes metrics"})
+    metrics = nodes_metrics(ctx, cluster)
+
+    job = JobParams(jobid)
+    request_params(ctx, cluster, job)
+    try:
+        window = ctx.db.window(job, period)
+        return (ctx.db.get_nodes_matrix(cluster, job, metrics, window),
+                window[2])
+    except Exception as err:
+        current_app.logger.exception(err)
+        abort(500, {'error': str(err)})
+
+
+@api.route('/nodes/<cluster>/<int:jobid>', defaults={'period': '1h'})
+@api.route('/nodes/<cluster>/<int:jobid>/<period>')
+def nodes(cluster, jobid, period):
+    """Matrix of the metrics of every node of the job, in binary format by
+       default or in JSON format with format=json."""
+
+    profiler = Profiler()
+
+    fmt = request.args.get('format', 'binary')
+    if fmt not in ['binary', 'json']:
+        abort(500, {'error': "format %s is not valid" % (fmt)})
+
+    current_app.logger.info("GET nodes cluster %s jobid %d"
+                            % (cluster, jobid))
+    (matrix, interval) = request_nodes_matrix(cluster, jobid, period)
+
+    profiler.start('serialization')
+    if fmt == 'json':
+        resp = jsonify(Formats.dump_matrix_json(matrix, interval,
+                                                profiler.dump()))
+    else:
+        resp = Response(Formats.dump_matrix_binary(matrix, interval,
+                                                   profiler.dump()),
+                        mimetype=Formats.matrix_mimetype)
+    profiler.stop('serialization')
+    return resp
+
+
+@api.route('/outliers/<cluster>/<int:jobid>', defaults={'period': '1h'})
+@api.route('/outliers/<cluster>/<int:jobid>/<period>')
+def outliers(cluster, jobid, period):
+    """The k nodes of the job (5 by default) with the most deviating values
+       of every metric, compared to the median of all the nodes."""
+
+    profiler = Profiler()
+
+    k = request.args.get('k', 5, type=int)
+    current_app.logger.info("GET outliers cluster %s jobid %d"
+                            % (cluster, jobid))
+    (matrix, interval) = request_nodes_matrix(cluster, jobid, period)
+
+    profiler.start('metrics_outliers')
+    resp = {}
+    resp['outliers'] = matrix.outliers(k)
+    profiler.stop('metrics_outliers')
+    resp['interval'] = interval
+    resp['debug'] = profiler.dump()
+    return jsonify(resp)
+
+
+def job_summary(ctx, cluster, jobid):
+    """Returns the efficiency summary of the whole job, computed out of its
+       metrics or found in the summary index. Raises the errors of the
+       requests of the params and metrics of the job."""
+
+    if ctx.summaries is not None:
+        summary = ctx.summaries.get(cluster, [jobid]).get(jobid)
+        if summary is not None:
+            return summary
+
+    job = JobParams(jobid)
+    job_data = JobData(cluster, job, 'job',
+                       ctx.conf.cluster_metrics(cluster))
+    if ctx.archive is None or not job_data.restore(ctx.archive):
+        job.request_params(ctx.slurm_api(cluster), ctx.jobs_cache,
+                           ctx.flights)
+        job_data.request(ctx.db, ctx.archive, ctx.flights)
+    summary = summarize(job_data)
+    if ctx.summaries is not None and job.settled:
+        ctx.summaries.put(cluster, jobid, summary)
+    return summary
+
+
+@api.route('/summary/<cluster>/<int:jobid>')
+def summary(cluster, jobid):
+    """Efficiency summary of the whole job."""
+
+    ctx = app_context()
+    profiler = Profiler()
+
+    if np is None:
+        abort(500, {'error': "numpy is required for summaries"})
+
+    current_app.logger.info("GET summary cluster %s jobid %d"
+                            % (cluster, jobid))
+    try:
+        resp = {}
+        resp['summary'] = job_summary(ctx, cluster, jobid)
+        resp['debug'] = profiler.dump()
+    except IndexError as err:
+        abort(404, {'error': str(err)})
+    except Exception as err:
+        current_app.logger.exception(err)
+        abort(500, {'error': str(err)})
+    finally:
+        ctx.cache.write()
+    return jsonify(resp)
+
+
+@api.route('/summary/<cluster>')
+def batch_summary(cluster):
+    """Efficiency summaries of the jobs given in the comma separated list of
+       the jobs parameter. The jobs whose summary can not be computed are
+       reported with the error."""
+
+    ctx = app_context()
+    profiler = Profiler()
+
+    if np is None:
+        abort(500, {'error': "numpy is required for summaries"})
+
+    try:
+        jobids = [int(jobid)
+                  for jobid in request.args.get('jobs', '').split(',')
+                  if jobid]
+    except ValueError:
+        abort(500, {'error': "jobs %s are not valid"
+                             % (request.args.get('jobs'))})
+    if not jobids:
+        abort(500, {'error': "jobs are missing"})
+    if len(jobids) > ctx.conf.batch_max_jobs:
+        abort(500, {'error': "too many jobs, the maximum is %d"
+                             % (ctx.conf.batch_max_jobs)})
+
+    current_app.logger.info("GET summary cluster %s %d jobs"
+                            % (cluster, len(jobids)))
+
+    # lookup all indexed summaries at once
+    summaries = {}
+    if ctx.summaries is not None:
+        summaries = ctx.summaries.get(cluster, jobids)
+    profiler.meta('summaries_indexed', str(len(summaries)))
+
+    errors = {}
+    for jobid in jobids:
+        if jobid in summaries:
+            continue
+        try:
+            summaries[jobid] = job_summary(ctx, cluster, jobid)
+        except Exception as err:
+            errors[str(jobid)] = str(err)
+    ctx.cache.write()
+
+    resp = {}
+    resp['summaries'] = {str(jobid): summary
+                         for jobid, summary in summaries.iteritems()}
+    resp['errors'] = errors
+    resp['debug'] = profiler.dump()
+    return jsonify(resp)
+
+
+@api.route('/metrics/<cluster>/<int:jobid>', defaults={'period': '1h'})
+@api.route('/metrics/<cluster>/<int:jobid>/<period>')
+def metrics(cluster, jobid, period):
+
+    ctx = app_context()
+    profiler = Profiler()
+
+    current_app.logger.info("GET cluster %s jobid %d" % (cluster, jobid))
 
     # Check the period given in parameter is valid. If not, return 500.
     if period not in periods.keys():
         abort(500, {'error': "period %s is not valid" % (period)})
 
+    # The optional since parameter is an epoch in ms. When given, only the
+    # time buckets starting at this time or later are sent.
+    since = request.args.get('since', type=int)
+    fmt = response_format()
+    metrics = requested_metrics(ctx, cluster)
+
+    job = JobParams(jobid)
+    job_data = JobData(cluster, job, period, metrics, since)
+
+    # The data of terminated jobs are served from the archive when available,
+    # without requesting neither the Slurm API nor InfluxDB.
+    archived = ctx.archive is not None and job_data.restore(ctx.archive)
+    profiler.meta('archived', str(archived))
+
+    if not archived:
+        # The critical path covers the requests of the job params and data.
+        profiler.start('critical_path')
+        request_params(ctx, cluster, job)
+
     try:
-        db = MetricsDB(conf)
-        job_data = JobData(cluster, job, period)
-        job_data.request(db)
+        if not archived:
+            job_data.request(ctx.db, ctx.metrics_archive(cluster, metrics),
+                             ctx.flights)
+            profiler.stop('critical_path')
+        # The response is not serialized when the client already has it, in
+        # either representation.
+        etag = metrics_etag(job_data, fmt)
+        for current in [etag, gzip_etag(etag)]:
+            if request.if_none_match.contains(current):
+                resp = Response(status=304)
+                resp.set_etag(current)
+                resp.vary.add('Accept')
+                resp.vary.add('Accept-Encoding')
+                resp.headers['Cache-Control'] = metrics_cache_control(job)
+                return resp
+        # The serialization timer is still running when the debug data are
+        # dumped, it is recorded in the process statistics only.
+        profiler.start('serialization')
+        if fmt == 'columnar':
+            resp = jsonify(Formats.dump_columnar(job_data, profiler.dump()))
+            resp.mimetype = Formats.columnar_mimetype
+        elif fmt == 'binary':
+            resp = Response(Formats.dump_binary(job_data, profiler.dump()),
+                            mimetype=Formats.binary_mimetype)
+        else:
+            resp = {}
+            resp['data'] = job_data.dump()
+            resp['metrics'] = job_data.metric_names
+            resp['interval'] = job_data.interval
+            resp['debug'] = profiler.dump()
+            resp = jsonify(resp)
+        profiler.stop('serialization')
+        resp.set_etag(etag)
+        # the representation is negotiated with the Accept header
+        resp.vary.add('Accept')
+        resp.headers['Cache-Control'] = metrics_cache_control(job)
+        return resp
+    except Exception as err:
+        current_app.logger.exception(err)
+        abort(500, {'error': str(err)})
+
+
+@api.route('/metrics/<cluster>')
+def batch_metrics(cluster):
+    """Metrics of the jobs given in the comma separated list of the jobs
+       parameter, at lower resolution."""
+
+    ctx = app_context()
+    profiler = Profiler()
+
+    period = request.args.get('period', '1h')
+    if period not in periods.keys():
+        abort(500, {'error': "period %s is not valid" % (period)})
+
+    try:
+        jobids = [int(jobid)
+                  for jobid in request.args.get('jobs', '').split(',')
+                  if jobid]
+    except ValueError:
+        abort(500, {'error': "jobs %s are not valid"
+                             % (request.args.get('jobs'))})
+    if not jobids:
+        abort(500, {'error': "jobs are missing"})
+    if len(jobids) > ctx.conf.batch_max_jobs:
+        abort(500, {'error': "too many jobs, the maximum is %d"
+                             % (ctx.conf.batch_max_jobs)})
+
+    current_app.logger.info("GET cluster %s %d jobs" % (cluster, len(jobids)))
+
+    batch = JobsBatch(cluster, jobids, period,
+                      requested_metrics(ctx, cluster),
+                      ctx.conf.untagged_metrics)
+    if not batch.metric_names:
+        abort(400, {'error': "no metric tagged with the jobs is selected"})
+    try:
+        batch.request_params(ctx.slurm_api(cluster), ctx.jobs_cache,
+                             ctx.flights)
+    except (ValueError, ConnectionError, Exception) as err:
+        abort(500, {'error': err.message})
+
+    # Write the cache at this point since it will not be modified then
+    ctx.cache.write()
+
+    try:
+        batch.request(ctx.db)
+        profiler.start('serialization')
         resp = {}
-        resp['data'] = job_data.dump()
+        resp['jobs'] = batch.dump()
+        resp['missing'] = batch.missing
+        resp['metrics'] = batch.metric_names
+        resp['interval'] = batch.interval
         resp['debug'] = profiler.dump()
-        return jsonify(resp)
+        resp = jsonify(resp)
+        profiler.stop('serialization')
+        return resp
     except Exception as err:
-        app.logger.exception(err)
+        current_app.logger.exception(err)
+        abort(500, {'error': str(err)})
+
+
+@api.route('/stream/<cluster>/<int:jobid>', defaults={'period': '1h'})
+@api.route('/stream/<cluster>/<int:jobid>/<period>')
+def stream(cluster, jobid, period):
+    """Stream of the metrics of the job with Server-Sent Events. The first
+       metrics event contains all the time buckets of the window, then every
+       event contains the new buckets, starting with the last one sent
+       previously since it was possibly incomplete. The end event is sent
+       when the job is over. The streams are refused with 503 above the
+       maximum number of clients, the dashboards then poll the metrics."""
+
+    ctx = app_context()
+
+    if period not in periods.keys():
+        abort(500, {'error': "period %s is not valid" % (period)})
+
+    metrics = requested_metrics(ctx, cluster)
+
+    current_app.logger.info("STREAM cluster %s jobid %d" % (cluster, jobid))
+    subscription = ctx.streams.subscribe(cluster, jobid, period, metrics)
+    if subscription is None:
+        abort(503, {'error': "too many streams, poll the metrics instead"})
+    (job_stream, events) = subscription
+    keepalive = ctx.conf.stream_interval * 2
+
+    def generate():
+        # delay of reconnection by the browser, in ms
+        yield "retry: %d\n\n" % (keepalive * 1000)
+        while True:
+            try:
+                (event, data) = events.get(timeout=keepalive)
+            except Queue.Empty:
+                # comment line to detect closed connections
+                yield ": keepalive\n\n"
+                continue
+            yield "event: %s\ndata: %s\n\n" % (event, json.dumps(data))
+            if event == 'end':
+                return
+
+    response = Response(generate(),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+    # the WSGI server closes the response even if the generator has not
+    # started, the subscriber is then always removed
+    response.call_on_close(lambda: ctx.streams.unsubscribe(job_stream,
+                                                           events))
+    return response
+
+
+@api.route('/registry/<cluster>')
+def registry(cluster):
+    """Metrics collected on the cluster with their aggregation mode, unit
+       and untagged flag, in the order of the values of the metrics of the
+       jobs."""
+
+    ctx = app_context()
+
+    try:
+        metrics = ctx.conf.cluster_metrics(cluster)
+    except ValueError as err:
         abort(500, {'error': str(err)})
+    return jsonify({'metrics': [{'name': metric,
+                                 'aggregation':
+                                     ctx.conf.metrics[metric]['aggregation'],
+                                 'unit': ctx.conf.metrics[metric]['unit'],
+                                 'untagged':
+                                     ctx.conf.metrics[metric]['untagged']}
+                                for metric in metrics]})
+
+
+@api.route('/stats')
+def stats():
+    """Statistics of the process in Prometheus text format."""
+
+    return Response(current_app.extensions['jobmetrics'].stats.dump(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+def create_app():
+    """Create the Flask application with its process-level AppContext. The
+       configuration is loaded lazily by the first request since its path can
+       be given in request environment."""
+
+    app = Flask('jobmetrics')
+    # By default flask redirects "metrics/CLUSTER/JOB/1h" to
+    # "metrics/CLUSTER/JOB" since 1h is the default. This is nice on
+    # a browser but the JS client doesn't like it
+    app.url_map.redirect_defaults = False
+    app.extensions['jobmetrics'] = AppContext(app.logger)
+    app.register_blueprint(api)
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Export the metrics of terminated jobs of a cluster to columnar files, one
+   file per job, without going through the REST API. The jobs are exported
+   by a pool of processes. The export can be resumed after an interruption,
+   the jobs already exported are skipped.
+
+   Usage: jobmetrics-export [options] CLUSTER JOBS
+
+   JOBS is a comma separated list of job IDs or ranges of job IDs, ex:
+   1000-1999,2042
+"""
+
+import os
+import sys
+import logging
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from jobmetrics.Conf import Conf, periods, default_path
+from jobmetrics.Cache import Cache
+from jobmetrics.SlurmAPI import SlurmAPI
+from jobmetrics.MetricsDB import MetricsDB
+from jobmetrics.MetricsArchive import MetricsArchive
+from jobmetrics.JobParams import JobParams
+from jobmetrics.JobData import JobData
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger('jobmetrics-export')
+
+# extensions of the files of the formats
+extensions = {'npz': 'npz', 'parquet': 'parquet'}
+
+# state of the worker processes, set by init_worker()
+worker = {}
+
+
+def parse_jobs(value):
+    """Returns the sorted list of job IDs of the comma separated list of job
+       IDs or ranges of job IDs."""
+
+    jobids = set()
+    try:
+        for item in value.split(','):
+            if not item:
+                continue
+            if '-' in item:
+                (first, last) = item.split('-', 1)
+                jobids.update(range(int(first), int(last) + 1))
+            else:
+                jobids.add(int(item))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid jobs %s" % (value))
+    return sorted(jobids)
+
+
+def output_path(output, cluster, jobid, fmt):
+
+    return os.path.join(output, cluster,
+                        "%d.%s" % (jobid, extensions[fmt]))
+
+
+def write_npz(fpath, job_data):
+
+    (timestamps, columns) = job_data.columns()
+    arrays = {'timestamps': np.array(timestamps, dtype=np.int64)}
+    for (metric, column) in zip(job_data.metric_names, columns):
+        arrays[metric] = np.array(column, dtype=np.float64)
+    np.savez_compressed(fpath,
+                        interval=np.array(job_data.interval),
+                        state=np.array(job_data.job.state),
+                        start_time=np.array(job_data.job.start_time),
+                        end_time=np.array(job_data.job.end_time),
+                        nodes=np.array(str(job_data.job.nodeset)),
+                        **arrays)
+
+
+def write_parquet(fpath, job_data):
+
+    (timestamps, columns) = job_data.columns()
+    names = ['timestamp'] + job_data.metric_names
+    arrays = [pyarrow.array(timestamps, type=pyarrow.int64())] + \
+             [pyarrow.array(column, type=pyarrow.float64())
+              for column in columns]
+    table = pyarrow.Table.from_arrays(arrays, names=names)
+    job = job_data.job
+    table = table.replace_schema_metadata({
+        'interval': str(job_data.interval),
+        'state': job.state,
+        'start_time': str(job.start_time),
+        'end_time': str(job.end_time),
+        'nodes': str(job.nodeset)})
+    pyarrow.parquet.write_table(table, fpath)
+
+
+writers = {'npz': write_npz, 'parquet': write_parquet}
+
+
+def init_worker(conf_path, semaphore):
+    """Initialize the clients of the worker process. The semaphore is shared
+       by all the workers to bound the number of concurrent InfluxDB
+       queries."""
+
+    conf = Conf(conf_path)
+    worker['conf'] = conf
+    # The tokens cache of the REST API is only read, the tokens obtained by
+    # the workers are kept in memory. The export is usually run by another
+    # user, the cache file and its lock must not be replaced by files the
+    # REST API can not write anymore.
+    worker['cache'] = Cache(conf.cache_path)
+    worker['db'] = MetricsDB(conf)
+    worker['apis'] = {}
+    if conf.archive_path:
+        worker['archive'] = MetricsArchive(conf.archive_path,
+                                           conf.archive_max_size)
+    else:
+        worker['archive'] = None
+    worker['semaphore'] = semaphore
+
+
+def export_job(args):
+    """Export the metrics of the job in the file at fpath. Returns the job ID
+       and the status of the export, either exported, running if the job is
+       not over for long enough for its metrics to be final, or an error
+       message."""
+
+    (cluster, jobid, period, fmt, fpath) = args
+
+    try:
+        if cluster not in worker['apis']:
+            worker['apis'][cluster] = SlurmAPI(worker['conf'], cluster,
+                                               worker['cache'])
+        job = JobParams(jobid)
+        job_data = JobData(cluster, job, period,
+                           worker['conf'].cluster_metrics(cluster))
+        archive = worker['archive']
+        if archive is None or not job_data.restore(archive):
+            job.request_params(worker['apis'][cluster])
+            if not job.settled:
+                return (jobid, 'running')
+            # the archive of the REST API is only read, the exported jobs
+            # must not evict its entries nor create files with other owners
+            with worker['semaphore']:
+                job_data.request(worker['db'])
+
+        # write in a temporary file renamed at the end so that an
+        # interrupted export leaves no partial file
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(fpath),
+                                          suffix='.tmp')
+        os.close(fd)
+        try:
+            writers[fmt](tmp_path, job_data)
+            # numpy.savez adds the extension if missing
+            if fmt == 'npz' and not tmp_path.endswith('.npz'):
+                os.rename(tmp_path + '.npz', tmp_path)
+            os.rename(tmp_path, fpath)
+        except:
+            for path in [tmp_path, tmp_path + '.npz']:
+                if os.path.exists(path):
+                    os.unlink(path)
+            raise
+        return (jobid, 'exported')
+    except Exception as err:
+        return (jobid, "error: %s" % (err))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Export the metrics of terminated jobs to columnar "
+                    "files.")
+    parser.add_argument('cluster')
+    parser.add_argument('jobs', type=parse_jobs,
+                        help="comma separated list of job IDs or ranges of "
+                             "job IDs")
+    parser.add_argument('-c', '--conf',
+                        default=os.environ.get('JOBMETRICS_CONF_FILE',
+                                               default_path),
+                        help="configuration file (default: %(default)s)")
+    parser.add_argument('-o', '--output', default='.',
+                        help="output directory, the files are written in a "
+                             "subdirectory per cluster (default: "
+                             "%(default)s)")
+    parser.add_argument('-f', '--format', default='npz',
+                        choices=sorted(writers.keys()))
+    parser.add_argument('-p', '--period', default='job',
+                        choices=sorted(periods.keys()))
+    parser.add_argument('-w', '--workers', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="number of worker processes (default: "
+                             "%(default)s)")
+    parser.add_argument('-q', '--max-queries', type=int, default=4,
+                        help="maximum number of concurrent InfluxDB queries "
+                             "(default: %(default)s)")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s %(levelname)s: %(message)s')
+
+    if args.format == 'npz' and np is None:
+        parser.error("numpy is required for npz format")
+    if args.format == 'parquet' and pyarrow is None:
+        parser.error("pyarrow is required for parquet format")
+
+    conf = Conf(args.conf)
+    if args.cluster not in conf.clusters:
+        parser.error("cluster %s is not defined in %s"
+                     % (args.cluster, args.conf))
+
+    directory = os.path.join(args.output, args.cluster)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # resume: skip the jobs already exported
+    tasks = []
+    for jobid in args.jobs:
+        fpath = output_path(args.output, args.cluster, jobid, args.format)
+        if not os.path.exists(fpath):
+            tasks.append((args.cluster, jobid, args.period, args.format,
+                          fpath))
+    logger.info("%d jobs to export, %d already exported",
+                len(tasks), len(args.jobs) - len(tasks))
+
+    semaphore = multiprocessing.BoundedSemaphore(args.max_queries)
+    pool = multiprocessing.Pool(args.workers, init_worker,
+                                (args.conf, semaphore))
+    counts = {'exported': 0, 'running': 0, 'error': 0}
+    try:
+        for (jobid, status) in pool.imap_unordered(export_job, tasks):
+            if status in counts:
+                counts[status] += 1
+                logger.debug("job %d: %s", jobid, status)
+            else:
+                counts['error'] += 1
+                logger.warning("job %d: %s", jobid, status)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        logger.info("interrupted, run again to resume")
+        return 1
+    finally:
+        pool.join()
+
+    logger.info("%d jobs exported, %d still running or just over, %d errors",
+                counts['exported'], counts['running'], counts['error'])
+    return 1 if counts['error'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The aggregators compute the sum of the values of all the nodes of a job at
+   every timestamp, for each metric, out of the series returned by InfluxDB.
+   The NumpyAggregator is used when NumPy is available, otherwise it falls
+   back to the PythonAggregator."""
+
+from itertools import chain
+from ClusterShell.NodeSet import NodeSet
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Some metrics, such as cpus, can be produced by several batch servers and
+# thus returned multiple times by InfluxDB server in the result of the
+# request. The values of these metrics, given in the last list of the
+# aggregators, must not be summed, the last value is kept instead.
+
+
+class PythonAggregator(object):
+
+    def __init__(self, metrics, last):
+
+        self.metrics = metrics
+        self.last = last
+        self.nodes = set()
+        self.values = {}
+
+    def add(self, metric, node, values):
+        """Add the series of values, as a list of [timestamp, value] pairs,
+           of the metric on the node. The node is None for series already
+           summed over all nodes."""
+
+        if node is not None:
+            self.nodes.add(node)
+        index = self.metrics.index(metric)
+        last = metric in self.last
+
+        for pair in values:
+            timestamp = str(pair[0])
+            if timestamp not in self.values:
+                # init all values for timestamp to 0
+                self.values[timestamp] = [0]*len(self.metrics)
+            if last:
+                self.values[timestamp][index] = pair[1]
+            else:
+                self.values[timestamp][index] += pair[1]
+
+    def merge(self, other):
+        """Add all the values of the other aggregator. This is meant to merge
+           partial aggregations over disjoint sets of nodes."""
+
+        self.nodes.update(other.nodes)
+        for timestamp, values in other.values.iteritems():
+            if timestamp not in self.values:
+                self.values[timestamp] = list(values)
+            else:
+                current = self.values[timestamp]
+                for index, value in enumerate(values):
+                    current[index] += value
+
+    @property
+    def nodeset(self):
+
+        return NodeSet.fromlist(self.nodes)
+
+    def results(self):
+        """Returns the dict of values, with timestamps as keys and the list of
+           values for all metrics as values."""
+
+        return self.values
+
+
+class NumpyAggregator(object):
+
+    # number of points buffered before being reduced
+    batch_points = 1 << 16
+
+    def __init__(self, metrics, last):
+
+        self.metrics = metrics
+        self.nodes = set()
+        # Sorted array of all timestamps, the shared grid all series are
+        # aligned on, and the 2D array of values with one row per timestamp
+        # and one column per metric.
+        self.grid = np.empty(0, dtype=np.int64)
+        self.values = np.zeros((0, len(metrics)), dtype=np.float64)
+        self.last = np.array([metric in last for metric in metrics],
+                             dtype=bool)
+        # series waiting to be reduced, as (column, points array) tuples
+        self.pending = []
+        self.pending_points = 0
+
+    def add(self, metric, node, values):
+        """Add the series of values, as a list of [timestamp, value] pairs,
+           of the metric on the node. The node is None for series already
+           summed over all nodes. The series are buffered and reduced by
+           batches."""
+
+        if node is not None:
+            self.nodes.add(node)
+        if not values:
+            return
+        try:
+            points = np.fromiter(chain.from_iterable(values),
+                                 dtype=np.float64,
+                                 count=2*len(values))
+        except TypeError:
+            # some values are null, consider them as 0
+            points = np.array([[pair[0], pair[1] or 0] for pair in values],
+                              dtype=np.float64)
+        self.pending.append((self.metrics.index(metric),
+                             points.reshape(-1, 2)))
+        self.pending_points += len(values)
+        if self.pending_points >= self.batch_points:
+            self.flush()
+
+    def align(self, timestamps):
+        """Extend the grid with the timestamps in parameter if needed and
+           return their indexes in the grid."""
+
+        # fast path when all timestamps are already in the grid
+        if self.grid.size:
+            rows = np.searchsorted(self.grid, timestamps)
+            found = self.grid[np.minimum(rows, self.grid.size - 1)]
+            if np.array_equal(found, timestamps):
+                return rows
+
+        grid = np.union1d(self.grid, timestamps)
+        if grid.size != self.grid.size:
+            values = np.zeros((grid.size, len(self.metrics)),
+                              dtype=np.float64)
+            values[np.searchsorted(grid, self.grid)] = self.values
+            self.grid = grid
+            self.values = values
+        return np.searchsorted(self.grid, timestamps)
+
+    def flush(self):
+        """Reduce all pending series into the values array."""
+
+        if not self.pending:
+            return
+
+        columns = np.repeat([column for (column, _) in self.pending],
+                            [points.shape[0] for (_, points) in self.pending])
+        points = np.concatenate([points for (_, points) in self.pending])
+        self.pending = []
+        self.pending_points = 0
+
+        rows = self.align(points[:, 0].astype(np.int64))
+        ncols = len(self.metrics)
+        # index of every point in the flattened values array
+        cells = rows * ncols + columns
+        last = self.last[columns]
+
+        # sum of all the points of sum metrics, in one call
+        summed = np.bincount(cells[~last],
+                             weights=points[~last, 1],
+                             minlength=self.values.size)
+        self.values += summed.reshape(self.values.shape)
+
+        # for last metrics, keep the value of the last point for every cell
+        if last.any():
+            last_cells = cells[last][::-1]
+            last_values = points[last, 1][::-1]
+            (cells_u, first) = np.unique(last_cells, return_index=True)
+            self.values.flat[cells_u] = last_values[first]
+
+    def merge(self, other):
+        """Add all the values of the other aggregator. This is meant to merge
+           partial aggregations over disjoint sets of nodes."""
+
+        self.nodes.update(other.nodes)
+        self.flush()
+        other.flush()
+        rows = self.align(other.grid)
+        self.values[rows] += other.values
+
+    @property
+    def nodeset(self):
+
+        return NodeSet.fromlist(self.nodes)
+
+    def results(self):
+        """Returns the dict of values, with timestamps as keys and the list of
+           values for all metrics as values."""
+
+        self.flush()
+        return dict(zip([str(timestamp) for timestamp in self.grid.tolist()],
+                        self.values.tolist()))
+
+
+if np is not None:
+    Aggregator = NumpyAggregator
+else:
+    Aggregator = PythonAggregator
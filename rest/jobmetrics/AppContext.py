@@ -0,0 +1,168 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The AppContext class holds the state shared by all the requests served by
+   a WSGI process: the parsed configuration, the logger and the long-lived
+   clients to the Slurm REST APIs and InfluxDB. The configuration file is
+   parsed again only when its modification time changes."""
+
+import os
+import threading
+
+import logging
+from logging.handlers import TimedRotatingFileHandler
+from logging import Formatter
+
+from jobmetrics.Conf import Conf
+from jobmetrics.Cache import Cache
+from jobmetrics.SlurmAPI import SlurmAPI
+from jobmetrics.MetricsDB import MetricsDB
+from jobmetrics.JobParamsCache import JobParamsCache
+from jobmetrics.MetricsArchive import MetricsArchive
+from jobmetrics.SummaryIndex import SummaryIndex
+from jobmetrics.SingleFlight import SingleFlight
+from jobmetrics.Stats import Stats
+from jobmetrics.Prefetcher import Prefetcher
+from jobmetrics.Streams import StreamRegistry
+
+
+class AppContext(object):
+
+    def __init__(self, logger):
+
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.conf_path = None
+        self.conf_mtime = None
+        self.conf = None
+        self.cache = None
+        self.db = None
+        self.jobs_cache = None
+        self.archive = None
+        self.summaries = None
+        self.flights = None
+        self.prefetcher = None
+        self.slurm_apis = {}
+        # the statistics and streams are kept over configuration reloads
+        self.stats = Stats()
+        self.streams = StreamRegistry(self)
+
+    def refresh(self, fpath):
+        """Load the configuration file at fpath unless it has already been
+           loaded and has not been modified since then. All the clients
+           depending on the configuration are reset on reload.
+        """
+
+        try:
+            mtime = os.stat(fpath).st_mtime
+        except OSError:
+            # Conf silently ignores missing files and uses its defaults.
+            mtime = None
+
+        if fpath == self.conf_path and mtime == self.conf_mtime:
+            return
+
+        with self.lock:
+            # another thread may have reloaded the conf in the meantime
+            if fpath == self.conf_path and mtime == self.conf_mtime:
+                return
+
+            conf = Conf(fpath)
+            self.init_logger(conf)
+            self.logger.info("configuration loaded from %s", fpath)
+
+            self.cache = Cache(conf.cache_path)
+            # The requests in progress keep using the previous MetricsDB, its
+            # pools are closed when it is released.
+            self.db = MetricsDB(conf)
+            self.jobs_cache = JobParamsCache(conf.jobs_cache_size,
+                                             conf.jobs_cache_ttl)
+            if conf.archive_path:
+                self.archive = MetricsArchive(conf.archive_path,
+                                              conf.archive_max_size)
+            else:
+                self.archive = None
+            if conf.summary_index:
+                self.summaries = SummaryIndex(conf.summary_index)
+            else:
+                self.summaries = None
+            self.flights = SingleFlight(conf.freshness)
+            self.slurm_apis = {}
+            self.conf = conf
+            self.conf_path = fpath
+            self.conf_mtime = mtime
+
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
+                self.prefetcher = None
+            if conf.prefetch_interval:
+                self.prefetcher = Prefetcher(self, conf.clusters,
+                                             self.jobs_cache,
+                                             conf.prefetch_interval)
+                self.prefetcher.start()
+
+    def metrics_archive(self, cluster, metrics):
+        """Returns the archive where the data of the metrics of the jobs of
+           the cluster are saved, None if the archive is disabled or if the
+           metrics are a subset of the metrics of the cluster since the
+           archive covers them all."""
+
+        if metrics != self.conf.cluster_metrics(cluster):
+            return None
+        return self.archive
+
+    def init_logger(self, conf):
+
+        log_h = TimedRotatingFileHandler(conf.log_path,
+                                         when='D',
+                                         interval=1,
+                                         backupCount=10)
+        if conf.debug:
+            log_h.setLevel(logging.DEBUG)
+        else:
+            log_h.setLevel(logging.INFO)
+        log_h.setFormatter(Formatter(
+            '%(asctime)s %(filename)s:%(lineno)d %(levelname)s: %(message)s'))
+
+        # Remove all other handlers and disable propagation to ancestor logger
+        # in order to avoid polluting HTTP server error log with app specific
+        # logs. The handlers set by a previous load of the conf are closed.
+        self.logger.propagate = False
+        for handler in self.logger.handlers:
+            handler.close()
+        self.logger.handlers = []
+        self.logger.addHandler(log_h)
+        if conf.debug:
+            self.logger.setLevel(logging.DEBUG)
+        else:
+            self.logger.setLevel(logging.INFO)
+
+    def slurm_api(self, cluster):
+        """Returns the SlurmAPI object of the cluster, it is created on first
+           call."""
+
+        slurm_apis = self.slurm_apis
+        if cluster not in slurm_apis:
+            with self.lock:
+                if cluster not in slurm_apis:
+                    slurm_apis[cluster] = SlurmAPI(self.conf,
+                                                   cluster,
+                                                   self.cache)
+        return slurm_apis[cluster]
@@ -18,59 +18,144 @@
 # You should have received a copy of the GNU General Public License
 # along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
+"""The Cache class stores the authentication tokens of the clusters. The
+   tokens are kept in memory between requests and shared with the other
+   processes through a JSON file. The file is written only when a token
+   actually changes, it is locked during the updates and atomically replaced
+   so that readers never get a partially written file."""
+
 import os
+import json
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
 
 from jobmetrics.ClusterCache import ClusterCache
 
 
+@contextmanager
+def flocked(path):
+    """Context manager that holds an exclusive lock on the file at path."""
+
+    with open(path, 'a') as lock_f:
+        fcntl.flock(lock_f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+
 class Cache(object):
 
     def __init__(self, path):
 
         self.path = path
+        self.lock_path = path + '.lock'
         self.cluster_caches = None
+        # clusters data as last read from or written to the file
+        self.synced = {}
+        self.mtime = None
+        self.lock = threading.RLock()
+
+    def load(self):
+        """Returns the struct stored in the file and its mtime."""
+
+        try:
+            with open(self.path, 'r') as cache_f:
+                mtime = os.fstat(cache_f.fileno()).st_mtime
+                return (json.load(cache_f), mtime)
+        except IOError:
+            # The file does not exist yet.
+            return ({}, None)
+        except ValueError:
+            # File exists but does not contain json data (probably empty).
+            # In this case, consider it is empty. It will be filled then
+            # with new data.
+            return ({}, None)
 
     def read(self):
 
-        # ensure dict is empty
-        self.cluster_caches = {}
-
-        if not os.path.exists(self.path):
-            return
-
-        with open(self.path, 'r') as cache_f:
-            try:
-                struct = json.load(cache_f)
-            except ValueError:
-                # File exists but does not contain json data (probably empty).
-                # In this case, return None so that cluster_caches dict stays
-                # empty. It will be filled then with new data.
-                return None
+        with self.lock:
+            # ensure dict is empty
+            self.cluster_caches = {}
+            (struct, self.mtime) = self.load()
             for cluster, data in struct.iteritems():
                 self.cluster_caches[cluster] = \
                     ClusterCache(data['token'],
                                  data['auth_enabled'],
                                  data['auth_guest'])
+                self.synced[cluster] = data
 
-    def write(self):
+    def refresh(self):
+        """Read the file again if it has been modified by another process and
+           update the caches of the clusters changed in the file. The
+           ClusterCache objects are updated in place since they are shared
+           with the SlurmAPI objects."""
 
-        struct = {}
-        for cluster, cache in self.cluster_caches.iteritems():
-            struct[cluster] = {'token': cache.token,
-                               'auth_enabled': cache.auth_enabled,
-                               'auth_guest': cache.auth_guest}
+        with self.lock:
+            if self.cluster_caches is None:
+                return self.read()
+            try:
+                if os.stat(self.path).st_mtime == self.mtime:
+                    return
+            except OSError:
+                return
+            (struct, self.mtime) = self.load()
+            for cluster, data in struct.iteritems():
+                if data == self.synced.get(cluster):
+                    continue
+                cache = self.get(cluster)
+                cache.token = data['token']
+                cache.auth_enabled = data['auth_enabled']
+                cache.auth_guest = data['auth_guest']
+                self.synced[cluster] = data
 
-        with open(self.path, 'w+') as cache_f:
-            json.dump(struct, cache_f)
+    def write(self):
+        """Write the caches of the clusters that have changed since the last
+           synchronization with the file. The file is read again under lock
+           so that the changes of other processes on other clusters are
+           kept."""
+
+        with self.lock:
+            if self.cluster_caches is None:
+                return
+
+            changed = {}
+            for cluster, cache in self.cluster_caches.iteritems():
+                data = {'token': cache.token,
+                        'auth_enabled': cache.auth_enabled,
+                        'auth_guest': cache.auth_guest}
+                if data != self.synced.get(cluster):
+                    changed[cluster] = data
+
+            if not changed:
+                return
+
+            with flocked(self.lock_path):
+                (struct, _) = self.load()
+                struct.update(changed)
+                (fd, tmp_path) = tempfile.mkstemp(
+                    dir=os.path.dirname(self.path), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w') as tmp_f:
+                        json.dump(struct, tmp_f)
+                    os.rename(tmp_path, self.path)
+                except:
+                    os.unlink(tmp_path)
+                    raise
+                self.mtime = os.stat(self.path).st_mtime
+
+            self.synced.update(changed)
 
     def get(self, cluster):
 
-        if self.cluster_caches is None:
-            self.read()
+        with self.lock:
+            if self.cluster_caches is None:
+                self.read()
 
-        # The cluster cache does not exist yet. Create a new empty cache.
-        if cluster not in self.cluster_caches:
-            self.cluster_caches[cluster] = ClusterCache()
+            # The cluster cache does not exist yet. Create a new empty cache.
+            if cluster not in self.cluster_caches:
+                self.cluster_caches[cluster] = ClusterCache()
 
-        return self.cluster_caches[cluster]
+            return self.cluster_caches[cluster]
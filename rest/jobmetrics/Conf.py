@@ -20,16 +20,42 @@
 
 import ConfigParser
 from StringIO import StringIO
+from collections import OrderedDict
 
-# valid periods with their associated interval group time
-periods = {'1h': '10s',
-           '6h': '60s',
-           '24h': '120s'}
+from jobmetrics.HTTPPool import HTTPPool
+
+# valid periods with their durations in seconds, the job period covers the
+# whole job time range
+periods = {'1h': 3600,
+           '6h': 21600,
+           '24h': 86400,
+           'job': None}
+
+# aggregation modes of the metrics over the nodes of the jobs: the values of
+# all nodes are summed, or the last value is kept for the metrics reported by
+# several batch servers
+aggregations = ['sum', 'last']
+
+# default registry of the metrics, used when the configuration file has no
+# metrics section
+default_metrics = [('cpu-system', 'sum, percent'),
+                   ('cpu-iowait', 'sum, percent'),
+                   ('cpu-user', 'sum, percent'),
+                   ('cpu-softirq', 'sum, percent'),
+                   ('cpu-idle', 'sum, percent'),
+                   ('memory-pss', 'sum, bytes'),
+                   ('memory-rss', 'sum, bytes'),
+                   ('utilization_gpu', 'sum, percent, untagged'),
+                   ('utilization_memory', 'sum, percent, untagged'),
+                   ('cpus', 'last, count')]
+
+# configuration file path used when none is given in environment
+default_path = '/etc/jobmetrics/jobmetrics.conf'
 
 
 class Conf(object):
 
-    def __init__(self, fpath='/etc/jobmetrics/jobmetrics.conf'):
+    def __init__(self, fpath=default_path):
 
         defaults = StringIO(
             "[global]\n"
@@ -38,24 +64,100 @@ class Conf(object):
             "tls_verify = true\n"
             "ca_filepath = /etc/ssl/certs/ca-certificates.crt\n"
             "debug = false\n"
+            "pool_size = 10\n"
+            "connect_timeout = 5\n"
+            "read_timeout = 60\n"
+            "jobs_cache_size = 4096\n"
+            "jobs_cache_ttl = 30\n"
+            "archive = /var/cache/jobmetrics/archive\n"
+            "archive_max_size = 1024\n"
+            "summary_index = /var/cache/jobmetrics/summaries.db\n"
+            "max_points = 360\n"
+            "min_interval = 10\n"
+            "downsampling = none\n"
+            "oversampling = 4\n"
+            "freshness = 2\n"
+            "batch_max_jobs = 256\n"
+            "batch_max_points = 60\n"
+            "prefetch_interval = 0\n"
+            "stream_interval = 10\n"
+            "stream_max_clients = 10\n"
+            "gzip_threshold = 1024\n"
             "[influxdb]\n"
             "server = http://localhost:8086\n"
-            "db = graphite\n")
+            "db = graphite\n"
+            "chunk_size = 10000\n"
+            "shard_size = 0\n"
+            "workers = 4\n"
+            "plan = nodes\n")
 
         self.conf = ConfigParser.RawConfigParser()
         self.conf.readfp(defaults)
         self.conf.read(fpath)
+        # The default registry is not merged with the metrics section of the
+        # file, so that the sites can remove metrics from the registry.
+        if not self.conf.has_section('metrics'):
+            self.conf.add_section('metrics')
+            for (metric, value) in default_metrics:
+                self.conf.set('metrics', metric, value)
         self.influxdb_server = self.conf.get('influxdb', 'server')
         self.influxdb_db = self.conf.get('influxdb', 'db')
+        self.influxdb_chunk_size = self.conf.getint('influxdb', 'chunk_size')
+        self.influxdb_shard_size = self.conf.getint('influxdb', 'shard_size')
+        self.influxdb_workers = self.conf.getint('influxdb', 'workers')
+        self.influxdb_plan = self.conf.get('influxdb', 'plan')
         self.cache_path = self.conf.get('global', 'cache')
         self.log_path = self.conf.get('global', 'log')
         self.tls_verify = self.conf.getboolean('global', 'tls_verify')
         self.ca_filepath = self.conf.get('global', 'ca_filepath')
         self.debug = self.conf.getboolean('global', 'debug')
-        # All sections except influxdb and global are cluster names. So get all
-        # sections names minus those two.
+        self.jobs_cache_size = self.conf.getint('global', 'jobs_cache_size')
+        self.jobs_cache_ttl = self.conf.getint('global', 'jobs_cache_ttl')
+        # archive is disabled if its path is empty
+        self.archive_path = self.conf.get('global', 'archive')
+        self.archive_max_size = self.conf.getint('global', 'archive_max_size')
+        # summary index is disabled if its path is empty
+        self.summary_index = self.conf.get('global', 'summary_index')
+        self.max_points = self.conf.getint('global', 'max_points')
+        self.min_interval = self.conf.getint('global', 'min_interval')
+        self.downsampling = self.conf.get('global', 'downsampling')
+        self.oversampling = self.conf.getint('global', 'oversampling')
+        self.freshness = self.conf.getfloat('global', 'freshness')
+        self.batch_max_jobs = self.conf.getint('global', 'batch_max_jobs')
+        self.batch_max_points = self.conf.getint('global', 'batch_max_points')
+        self.prefetch_interval = self.conf.getint('global',
+                                                  'prefetch_interval')
+        self.stream_interval = self.conf.getint('global', 'stream_interval')
+        self.stream_max_clients = self.conf.getint('global',
+                                                   'stream_max_clients')
+        self.gzip_threshold = self.conf.getint('global', 'gzip_threshold')
+        # registry of the metrics with their aggregation mode, unit and
+        # whether they are not tagged with the job, in the order of the
+        # values of the metrics of the jobs
+        self.metrics = OrderedDict()
+        for (metric, value) in self.conf.items('metrics'):
+            items = [item.strip() for item in value.split(',')]
+            if items[0] not in aggregations:
+                raise ValueError("aggregation %s of metric %s is not valid"
+                                 % (items[0], metric))
+            if len(items) > 2 and items[2] != 'untagged':
+                raise ValueError("flag %s of metric %s is not valid"
+                                 % (items[2], metric))
+            self.metrics[metric] = {'aggregation': items[0],
+                                    'unit': items[1] if len(items) > 1
+                                            else None,
+                                    'untagged': len(items) > 2}
+        self.last_metrics = [metric
+                             for (metric, info) in self.metrics.iteritems()
+                             if info['aggregation'] == 'last']
+        self.untagged_metrics = [metric
+                                 for (metric, info)
+                                 in self.metrics.iteritems()
+                                 if info['untagged']]
+        # All sections except influxdb, global and metrics are cluster names.
+        # So get all sections names minus those three.
         self.clusters = [cluster for cluster in self.conf.sections()
-                         if cluster not in ['influxdb', 'global']]
+                         if cluster not in ['influxdb', 'global', 'metrics']]
 
     def api(self, cluster):
 
@@ -86,3 +188,50 @@ class Conf(object):
             return self.conf.get(cluster, 'password')
         except ConfigParser.NoOptionError:
             return None
+
+    def cluster_metrics(self, cluster):
+
+        # Names of the metrics collected on the cluster, in the order of the
+        # registry, default to all the metrics of the registry.
+        try:
+            selected = [metric.strip() for metric
+                        in self.conf.get(cluster, 'metrics').split(',')
+                        if metric.strip()]
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            return self.metrics.keys()
+        for metric in selected:
+            if metric not in self.metrics:
+                raise ValueError("metric %s of cluster %s is not in the "
+                                 "metrics registry" % (metric, cluster))
+        return [metric for metric in self.metrics if metric in selected]
+
+    def pool_size(self, section):
+
+        # Size of the HTTP connections pool to the cluster or influxdb
+        # section, default to the global value.
+        try:
+            return self.conf.getint(section, 'pool_size')
+        except ConfigParser.NoOptionError:
+            return self.conf.getint('global', 'pool_size')
+
+    def connect_timeout(self, section):
+
+        try:
+            return self.conf.getfloat(section, 'connect_timeout')
+        except ConfigParser.NoOptionError:
+            return self.conf.getfloat('global', 'connect_timeout')
+
+    def read_timeout(self, section):
+
+        try:
+            return self.conf.getfloat(section, 'read_timeout')
+        except ConfigParser.NoOptionError:
+            return self.conf.getfloat('global', 'read_timeout')
+
+    def http_pool(self, section):
+        """Returns a new HTTPPool to the service of the section."""
+
+        return HTTPPool(section,
+                        self.pool_size(section),
+                        self.connect_timeout(section),
+                        self.read_timeout(section))
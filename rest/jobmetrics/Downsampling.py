@@ -0,0 +1,87 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Downsampling of the aggregated metrics of a job with the Largest-Triangle-
+   Three-Buckets (LTTB) algorithm.
+
+   All metrics share the same timestamps in the results, so the same points
+   must be selected for all of them. The area of the triangles is computed for
+   every metric, normalized by the range of values of this metric, and the
+   point with the largest sum of areas over all metrics is selected in every
+   bucket.
+"""
+
+
+def lttb(results, threshold):
+    """Returns a new results dict with at most threshold timestamps selected
+       with LTTB algorithm in the results dict in parameter."""
+
+    timestamps = sorted(results.keys(), key=int)
+    size = len(timestamps)
+    if threshold < 3 or size <= threshold:
+        return results
+
+    xs = [int(timestamp) for timestamp in timestamps]
+    columns = zip(*[results[timestamp] for timestamp in timestamps])
+    # Normalization factor of every metric. The constant metrics are ignored
+    # since all their points are equivalent.
+    scales = []
+    for column in columns:
+        amplitude = max(column) - min(column)
+        if amplitude > 0:
+            scales.append(1.0 / amplitude)
+        else:
+            scales.append(0.0)
+    metrics = [index for index, scale in enumerate(scales) if scale > 0]
+
+    # The first and the last points are always selected. The other points
+    # are divided in threshold - 2 buckets.
+    every = float(size - 2) / (threshold - 2)
+    selected = [0]
+    prev = 0
+    for bucket in range(threshold - 2):
+        # average point of the next bucket
+        next_start = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, size)
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / float(count)
+        avg_ys = [sum(columns[metric][next_start:next_end]) / float(count)
+                  for metric in metrics]
+
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        best = start
+        best_area = -1
+        for point in range(start, end):
+            area = 0.0
+            for (metric, avg_y) in zip(metrics, avg_ys):
+                column = columns[metric]
+                area += abs((xs[prev] - avg_x) * (column[point] - column[prev])
+                            - (xs[prev] - xs[point]) * (avg_y - column[prev])
+                            ) * scales[metric]
+            if area > best_area:
+                best = point
+                best_area = area
+        selected.append(best)
+        prev = best
+    selected.append(size - 1)
+
+    return {timestamps[point]: results[timestamps[point]]
+            for point in selected}
@@ -0,0 +1,112 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Alternative formats of the metrics of a job sent by the REST API, in
+   addition to the default JSON object with one list of values per timestamp:
+
+   - columnar: a JSON object with the names of the metrics, the list of
+     timestamps and one list of values per metric.
+   - binary: a compact layout the dashboard can load straight into typed
+     arrays. It starts with the 4 bytes magic string 'JMB1' and the length of
+     a JSON header as a little-endian uint32. The header is padded with spaces
+     so that the following arrays are 8 bytes aligned. It is followed by the
+     timestamps as little-endian int64 and then the values of all the metrics,
+     one metric after the other, as little-endian float32.
+
+   The matrix of the metrics of every node of a job is sent in a similar
+   binary layout starting with 'JMN1'. The header gives the names of the
+   metrics and of the nodes. The values are stored metric by metric, then
+   node by node, NaN for the missing values.
+"""
+
+import json
+import struct
+
+json_mimetype = 'application/json'
+columnar_mimetype = 'application/vnd.jobmetrics.columnar+json'
+binary_mimetype = 'application/vnd.jobmetrics.binary'
+
+# formats names with their associated mimetypes, the first one is the default
+formats = [('rows', json_mimetype),
+           ('columnar', columnar_mimetype),
+           ('binary', binary_mimetype)]
+
+binary_magic = 'JMB1'
+matrix_mimetype = 'application/vnd.jobmetrics.matrix'
+matrix_magic = 'JMN1'
+
+
+def dump_columnar(job_data, debug):
+
+    (timestamps, columns) = job_data.columns()
+    return {'metrics': job_data.metric_names,
+            'interval': job_data.interval,
+            'timestamps': timestamps,
+            'columns': columns,
+            'debug': debug}
+
+
+def dump_binary(job_data, debug):
+
+    (timestamps, columns) = job_data.columns()
+    header = json.dumps({'metrics': job_data.metric_names,
+                         'count': len(timestamps),
+                         'interval': job_data.interval,
+                         'debug': debug},
+                        separators=(',', ':'))
+    # pad the header so that the arrays start at an offset multiple of 8
+    header += ' ' * (-(len(binary_magic) + 4 + len(header)) % 8)
+    values = [value for column in columns for value in column]
+    return ''.join([binary_magic,
+                    struct.pack('<I', len(header)),
+                    header,
+                    struct.pack('<%dq' % len(timestamps), *timestamps),
+                    struct.pack('<%df' % len(values), *values)])
+
+
+def dump_matrix_json(matrix, interval, debug):
+
+    # NaN is not valid JSON, missing values are sent as null
+    values = [[[None if value != value else float(value) for value in serie]
+               for serie in metric]
+              for metric in matrix.values.tolist()]
+    return {'metrics': matrix.metrics,
+            'nodes': matrix.nodes,
+            'interval': interval,
+            'timestamps': matrix.timestamps.tolist(),
+            'values': values,
+            'debug': debug}
+
+
+def dump_matrix_binary(matrix, interval, debug):
+
+    header = json.dumps({'metrics': matrix.metrics,
+                         'nodes': matrix.nodes,
+                         'count': len(matrix.timestamps),
+                         'interval': interval,
+                         'debug': debug},
+                        separators=(',', ':'))
+    # pad the header so that the arrays start at an offset multiple of 8
+    header += ' ' * (-(len(matrix_magic) + 4 + len(header)) % 8)
+    return ''.join([matrix_magic,
+                    struct.pack('<I', len(header)),
+                    header,
+                    matrix.timestamps.astype('<i8').tostring(),
+                    matrix.values.astype('<f4').tostring()])
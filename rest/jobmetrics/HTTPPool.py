@@ -0,0 +1,70 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The HTTPPool class manages a persistent HTTP session with a pool of
+   keep-alive connections to a remote service. It is shared by all the threads
+   of the WSGI process so that TCP connections and TLS sessions are reused
+   across requests."""
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HTTPPool(object):
+
+    def __init__(self, name, size, connect_timeout, read_timeout):
+
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(pool_connections=size,
+                                   pool_maxsize=size)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def get(self, url, **kwargs):
+
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url=url, **kwargs)
+
+    def post(self, url, **kwargs):
+
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.post(url=url, **kwargs)
+
+    def stats(self):
+        """Returns the (hits, misses) tuple of counters summed over all the
+           connection pools of the session. A miss is a request that had to
+           open a new connection, a hit is a request that reused one."""
+
+        requests_nb = 0
+        connections_nb = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue  # evicted in the meantime
+            requests_nb += pool.num_requests
+            connections_nb += pool.num_connections
+        return (requests_nb - connections_nb, connections_nb)
+
+    def dump_stats(self):
+
+        return "hits: %d, misses: %d" % self.stats()
@@ -18,36 +18,111 @@
 # You should have received a copy of the GNU General Public License
 # along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+logger = logging.getLogger(__name__)
+
+from ClusterShell.NodeSet import NodeSet
+
 from jobmetrics.Profiler import Profiler
 
 
 class JobData(object):
 
-    def __init__(self, cluster, job, period):
+    def __init__(self, cluster, job, period, metrics, since=None):
 
         self.cluster = cluster
         self.job = job
         self.period = period
+        self.since = since
         self.nodeset = None
         self.metrics = None
+        # names of the metrics, in the order of the values of every timestamp
+        self.metric_names = metrics
+        self.interval = None
+
+    def restore(self, archive):
+        """Load the job params and data from the archive. Returns True if
+           found in archive with all the metrics, False otherwise."""
+
+        data = archive.load(self.cluster, self.job.jobid, self.period)
+        if data is None:
+            return False
+        # the archives without names predate the metrics registry, the
+        # metrics are requested again
+        names = data.get('names')
+        if names is None:
+            return False
+        if names != self.metric_names \
+           and not set(self.metric_names).issubset(names):
+            return False
+        self.job.load(data['job'])
+        self.interval = data.get('interval')
+        metrics = data['metrics']
+        if self.since is not None:
+            metrics = {timestamp: values
+                       for timestamp, values in metrics.iteritems()
+                       if int(timestamp) >= self.since}
+        if names != self.metric_names:
+            # select the values of the requested metrics
+            indexes = [names.index(metric) for metric in self.metric_names]
+            metrics = {timestamp: [values[index] for index in indexes]
+                       for timestamp, values in metrics.iteritems()}
+        self.metrics = metrics
+        self.nodeset = NodeSet(data['producers'].encode('utf-8'))
+        self.profile()
+        return True
+
+    @property
+    def flight_key(self):
+
+        return ('data', self.cluster, self.job.jobid, self.period,
+                self.since, tuple(self.metric_names))
+
+    def request(self, db, archive=None, flights=None):
+        """Request the job data in metrics database. If the archive is given
+           and the job is over, the data are saved in the archive unless only
+           the data since a given time are requested. If flights is given,
+           the identical concurrent requests are coalesced into one request to
+           the metrics database."""
 
-    def request(self, db):
-
-        (self.metrics, self.nodeset) = \
-            db.get_metrics_results(self.cluster,
-                                   self.job,
-                                   ['cpu-system',
-                                    'cpu-iowait',
-                                    'cpu-user',
-				    'cpu-softirq',
-                                    'cpu-idle',
-                                    'memory-pss',
-                                    'memory-rss',
-                                    'utilization_gpu',
-                                    'utilization_memory',
-				    'cpus'],
-                                   self.period)
+        if flights is None:
+            (self.interval, self.metrics, self.nodeset) = self.fetch(db,
+                                                                     archive)
+        else:
+            ((self.interval, self.metrics, self.nodeset), coalesced) = \
+                flights.do(self.flight_key, lambda: self.fetch(db, archive))
+            Profiler().meta('data_coalesced', str(coalesced))
+        self.profile()
+
+    def fetch(self, db, archive=None):
+        """Returns the interval, the metrics and the producers nodeset of the
+           job from the metrics database."""
+
+        window = db.window(self.job, self.period)
+        interval = window[2]
+        (metrics, nodeset) = db.get_metrics_results(self.cluster,
+                                                    self.job,
+                                                    self.metric_names,
+                                                    window,
+                                                    self.since)
         #self.stack_cpu_idle()
+        if archive is not None and self.since is None \
+           and self.job.settled:
+            # the archive is best-effort, the data are sent anyway
+            try:
+                archive.save(self.cluster, self.job.jobid, self.period,
+                             {'job': self.job.dump(),
+                              'interval': interval,
+                              'names': self.metric_names,
+                              'metrics': metrics,
+                              'producers': str(nodeset)})
+            except (IOError, OSError) as err:
+                logger.warning("unable to archive job %d of cluster %s: %s",
+                               self.job.jobid, self.cluster, err)
+        return (interval, metrics, nodeset)
+
+    def profile(self):
+
         profiler = Profiler()
         profiler.meta('producers', str(self.nodeset))
         profiler.meta('nodes', str(self.job.nodeset))
@@ -63,3 +138,14 @@ class JobData(object):
 
     def dump(self):
         return self.metrics
+
+    def columns(self):
+        """Returns the sorted list of timestamps (as integers) and the list of
+           values of every metric at these timestamps."""
+
+        timestamps = sorted(self.metrics.keys(), key=int)
+        if not timestamps:
+            return ([], [[] for _ in self.metric_names])
+        rows = [self.metrics[timestamp] for timestamp in timestamps]
+        return ([int(timestamp) for timestamp in timestamps],
+                [list(column) for column in zip(*rows)])
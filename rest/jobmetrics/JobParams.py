@@ -21,6 +21,22 @@
 import time
 from ClusterShell.NodeSet import NodeSet
 
+from jobmetrics.Profiler import Profiler
+
+# Slurm states of the jobs that are over, their params can not change anymore.
+terminal_states = ['COMPLETED',
+                   'CANCELLED',
+                   'FAILED',
+                   'TIMEOUT',
+                   'NODE_FAIL',
+                   'PREEMPTED',
+                   'BOOT_FAIL',
+                   'DEADLINE',
+                   'OUT_OF_MEMORY']
+# Delay in seconds after the end of a job before its metrics are considered
+# final, to let the last values reach InfluxDB.
+settle_time = 300
+
 
 class JobParams(object):
 
@@ -30,15 +46,57 @@ class JobParams(object):
         self.state = None
         self.nodeset = None
 
-    def request_params(self, api):
+    @property
+    def terminated(self):
+        return self.state in terminal_states
+
+    @property
+    def settled(self):
+        """True if the job is terminated for long enough so that its metrics
+           can not change anymore."""
+        return self.terminated and time.time() - self.end_time > settle_time
+
+    def request_params(self, api, cache=None, flights=None):
+        """Get the job params from the cache if given and the params are
+           still valid in it, or from the Slurm API otherwise. If flights is
+           given, the identical concurrent requests are coalesced into one
+           request to the Slurm API.
+        """
+
+        params = None
+        if cache is not None:
+            params = cache.get(api.cluster, self.jobid)
+        Profiler().meta('params_cached', str(params is not None))
+        if params is None:
+            if flights is None:
+                params = api.job_params(self.jobid)
+            else:
+                key = ('params', api.cluster, self.jobid)
+                (params, coalesced) = \
+                    flights.do(key, lambda: api.job_params(self.jobid))
+                Profiler().meta('params_coalesced', str(coalesced))
+            if cache is not None:
+                cache.put(api.cluster, self.jobid, params)
+        self.load(params)
+
+    def load(self, params):
 
-        params = api.job_params(self.jobid)
         self.state = params['job_state']
         self.nodeset = NodeSet(params['nodes'].encode('utf-8'))
         self.start_time = params['start_time']
         epoch_time = int(time.time())
-	if epoch_time < params['end_time']:
-		self.end_time = epoch_time
-	else:
-        	self.end_time = params['end_time']
+        if epoch_time < params['end_time']:
+            self.end_time = epoch_time
+        else:
+            self.end_time = params['end_time']
         self.shared = params['shared']
+
+    def dump(self):
+        """Returns the job params in the same format as the Slurm API so
+           they can be loaded back with load()."""
+
+        return {'job_state': self.state,
+                'nodes': str(self.nodeset),
+                'start_time': self.start_time,
+                'end_time': self.end_time,
+                'shared': self.shared}
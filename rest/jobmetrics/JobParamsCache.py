@@ -0,0 +1,80 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The JobParamsCache class is an in-process cache of the job parameters
+   returned by the Slurm REST APIs, keyed by cluster and job ID. It is bounded
+   in size with LRU eviction. Parameters of terminated jobs never expire since
+   they can not change anymore, others expire after a short TTL."""
+
+import time
+import threading
+from collections import OrderedDict
+
+from jobmetrics.JobParams import terminal_states
+
+
+class JobParamsCache(object):
+
+    def __init__(self, size, ttl):
+
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # (cluster, jobid) -> (params, expiration time or None)
+        self.entries = OrderedDict()
+
+    def get(self, cluster, jobid):
+        """Returns the cached params of the job or None if they are not in
+           cache or expired."""
+
+        key = (cluster, jobid)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            (params, expiration) = entry
+            if expiration is not None and expiration < time.time():
+                return None
+            # re-insert the entry to mark it as the most recently used
+            self.entries[key] = entry
+            return params
+
+    def put(self, cluster, jobid, params, ttl=None):
+        """Insert the job params in cache. The TTL is ignored for terminated
+           jobs, it defaults to cache TTL for others."""
+
+        if params['job_state'] in terminal_states:
+            expiration = None
+        else:
+            if ttl is None:
+                ttl = self.ttl
+            expiration = time.time() + ttl
+
+        key = (cluster, jobid)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (params, expiration)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, cluster, jobid):
+
+        with self.lock:
+            self.entries.pop((cluster, jobid), None)
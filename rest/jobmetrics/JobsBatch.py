@@ -0,0 +1,106 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+"""The JobsBatch class gets the metrics of many jobs of a cluster at once, with
+   one request to the Slurm API for the params of all jobs and one query to
+   InfluxDB for the metrics of all jobs, at a lower resolution than the
+   metrics of a single job."""
+
+from jobmetrics.JobParams import JobParams
+
+
+class JobsBatch(object):
+
+    def __init__(self, cluster, jobids, period, metrics, untagged):
+
+        self.cluster = cluster
+        self.jobids = jobids
+        self.period = period
+        # jobid -> JobParams of the jobs found
+        self.jobs = {}
+        self.missing = []
+        self.metrics = {}
+        # names of the metrics requested for every job of the batch, in the
+        # order of the values of every timestamp. The untagged metrics, such
+        # as the GPU metrics, can not be selected by job and are never
+        # requested for the jobs of the batch.
+        self.metric_names = [metric for metric in metrics
+                             if metric not in untagged]
+        self.interval = None
+
+    def request_params(self, api, cache=None, flights=None):
+        """Get the params of the jobs from the cache if given, or from the
+           Slurm API otherwise with one request for all the current jobs of
+           the cluster. The jobs that are not current anymore are requested
+           one by one. The jobs not found are reported as missing.
+        """
+
+        params = {}
+        for jobid in self.jobids:
+            if cache is not None:
+                params[jobid] = cache.get(api.cluster, jobid)
+            else:
+                params[jobid] = None
+
+        if None in params.values():
+            if flights is None:
+                current = api.jobs()
+            else:
+                (current, _) = flights.do(('jobs', api.cluster), api.jobs)
+            for jobid in [jobid for jobid in self.jobids
+                          if params[jobid] is None]:
+                if jobid in current:
+                    params[jobid] = current[jobid]
+                else:
+                    try:
+                        params[jobid] = api.job_params(jobid)
+                    except IndexError:
+                        self.missing.append(jobid)
+                        continue
+                if cache is not None:
+                    cache.put(api.cluster, jobid, params[jobid])
+
+        for jobid in self.jobids:
+            if jobid in self.missing:
+                continue
+            job = JobParams(jobid)
+            job.load(params[jobid])
+            self.jobs[jobid] = job
+
+    def request(self, db):
+        """Request the metrics of all the jobs that have been running in the
+           metrics database."""
+
+        running = [job for job in self.jobs.itervalues() if job.nodeset]
+        if not running:
+            return
+        window = db.batch_window(running, self.period)
+        self.interval = window[2]
+        self.metrics = db.get_batch_results(self.cluster,
+                                            [job.jobid for job in running],
+                                            self.metric_names,
+                                            window)
+
+    def dump(self):
+        """Returns a dict with the job IDs as keys and the state and metrics
+           of the jobs as values."""
+
+        return {str(jobid): {'state': job.state,
+                             'data': self.metrics.get(jobid, {})}
+                for jobid, job in self.jobs.iteritems()}
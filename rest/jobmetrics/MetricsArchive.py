@@ -0,0 +1,161 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The MetricsArchive class manages a local on-disk archive of the final
+   metrics of terminated jobs. There is one gzip compressed JSON file per
+   cluster, job and period. The total size of the archive is bounded, the
+   oldest files are removed first when the limit is exceeded."""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import gzip
+import json
+import time
+import tempfile
+import threading
+
+# Interval in seconds between the scans of the archive directory. The total
+# size of the archive is tracked in between, it is scanned again since other
+# processes write in the archive too.
+rescan_interval = 600
+# When the size limit is exceeded, the oldest files are removed until the
+# archive is under this fraction of the limit so that the scans of the
+# archive directory to select them are not repeated on every save.
+low_watermark = 0.9
+
+
+class MetricsArchive(object):
+
+    def __init__(self, path, max_size):
+
+        self.path = path
+        self.max_size = max_size * 1024 * 1024  # MiB to bytes
+        self.lock = threading.Lock()
+        # total size of the archive files and time of the last scan
+        self.size = None
+        self.scanned = None
+
+    def filepath(self, cluster, jobid, period):
+
+        return os.path.join(self.path,
+                            cluster,
+                            "%d.%s.json.gz" % (jobid, period))
+
+    def load(self, cluster, jobid, period):
+        """Returns the archived dict of the job for this period or None if
+           not found in archive."""
+
+        fpath = self.filepath(cluster, jobid, period)
+        try:
+            with gzip.open(fpath, 'rb') as archive_f:
+                return json.loads(archive_f.read())
+        except IOError:
+            # File does not exist (the most common case) or is not
+            # readable. In both cases, consider the job is not archived.
+            return None
+        except ValueError:
+            logger.warn("removing corrupted archive file %s", fpath)
+            self.remove(fpath)
+            return None
+
+    def save(self, cluster, jobid, period, data):
+        """Atomically write the data of the job for this period in the
+           archive, then enforce the size limit of the archive."""
+
+        fpath = self.filepath(cluster, jobid, period)
+        dirpath = os.path.dirname(fpath)
+        try:
+            previous = os.stat(fpath).st_size
+        except OSError:
+            previous = 0
+        if not os.path.isdir(dirpath):
+            try:
+                os.makedirs(dirpath)
+            except OSError:
+                # directory could have been created concurrently
+                if not os.path.isdir(dirpath):
+                    raise
+
+        (fd, tmp_path) = tempfile.mkstemp(dir=dirpath, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_f:
+                with gzip.GzipFile(fileobj=tmp_f, mode='wb') as archive_f:
+                    archive_f.write(json.dumps(data, separators=(',', ':')))
+            size = os.stat(tmp_path).st_size
+            os.rename(tmp_path, fpath)
+        except:
+            self.remove(tmp_path)
+            raise
+
+        logger.debug("job %d of cluster %s archived in %s",
+                     jobid, cluster, fpath)
+        self.enforce_size(size - previous)
+
+    def remove(self, fpath):
+
+        try:
+            os.unlink(fpath)
+        except OSError:
+            pass
+
+    def scan(self):
+        """Returns the list of the archive files as (mtime, size, path)
+           tuples sorted by mtime and update the total size of the archive.
+           The temporary files of the writes in progress are ignored."""
+
+        files = []
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                fpath = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(fpath)
+                except OSError:
+                    continue  # removed in the meantime
+                files.append((stat.st_mtime, stat.st_size, fpath))
+        files.sort()
+        self.size = sum([size for (_, size, _) in files])
+        self.scanned = time.time()
+        return files
+
+    def enforce_size(self, added):
+        """Add the size of the bytes added to the archive to its total size
+           and remove the oldest archive files if it exceeds the limit."""
+
+        with self.lock:
+            if self.size is None \
+               or time.time() - self.scanned > rescan_interval:
+                self.scan()
+            else:
+                self.size += added
+
+            if self.size <= self.max_size:
+                return
+
+            files = self.scan()
+            for (_, size, fpath) in files:
+                if self.size <= self.max_size * low_watermark:
+                    break
+                logger.info("removing archive file %s to free space", fpath)
+                self.remove(fpath)
+                self.size -= size
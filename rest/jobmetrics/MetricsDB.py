@@ -21,12 +21,17 @@
 import logging
 logger = logging.getLogger(__name__)
 
-import requests
+import re
 import json
-from ClusterShell.NodeSet import NodeSet
+import math
+import threading
+from multiprocessing.pool import ThreadPool
 
 from jobmetrics.Conf import periods
 from jobmetrics.Profiler import Profiler
+from jobmetrics.Aggregator import Aggregator
+from jobmetrics.Downsampling import lttb
+from jobmetrics.NodesMatrix import NodesMatrix
 
 
 class MetricsDB(object):
@@ -36,56 +41,100 @@ class MetricsDB(object):
         self.base_url = conf.influxdb_server
         self.db = conf.influxdb_db
         self.url = "{base}/query".format(base=self.base_url)
+        self.pool = conf.http_pool('influxdb')
+        self.chunk_size = conf.influxdb_chunk_size
+        self.shard_size = conf.influxdb_shard_size
+        self.workers = conf.influxdb_workers
+        self.plan = conf.influxdb_plan
+        self.max_points = conf.max_points
+        self.min_interval = conf.min_interval
+        self.downsampling = conf.downsampling
+        self.oversampling = conf.oversampling
+        self.batch_max_points = conf.batch_max_points
+        # metrics whose last value is kept instead of the sum over the nodes
+        self.last_metrics = conf.last_metrics
+        self.workers_pool = None
+        self.lock = threading.Lock()
 
-    def get_metrics_results(self, cluster, job, metrics, period):
-        """Get the metrics of the job on the cluster for the period in parameters.
+    def close(self):
+        """Close the pool of threads, the tasks already submitted are still
+           completed."""
 
-           It sends an HTTP request to InfluxDB service to download the metric
-           values in JSON format and returns a list.
+        if self.workers_pool is not None:
+            self.workers_pool.close()
+
+    def __del__(self):
+
+        self.close()
+
+    def get_workers_pool(self):
+        """Returns the pool of threads used to send concurrent queries to
+           InfluxDB. It is shared by all requests so its size bounds the
+           total number of concurrent sharded queries of the process."""
+
+        if self.workers_pool is None:
+            with self.lock:
+                if self.workers_pool is None:
+                    self.workers_pool = ThreadPool(self.workers)
+        return self.workers_pool
+
+    def query(self, req):
+        """Send the request to InfluxDB and returns the HTTP response. In
+           streaming mode, the body of the response is downloaded while it is
+           parsed by series(). The query is sent in the body of a POST request
+           since the regular expressions of the nodes of large jobs exceed the
+           limits of the URL length of InfluxDB and proxies.
         """
-	timejob=job.end_time-job.start_time	
-        logger.debug("time job: %d", timejob)
-	if timejob < 3600:
-		period="1h"
-	if timejob < 21600 and timejob > 3600:
-		period="6h"
 
-        time_group = periods[period]
+        payload = {'db': self.db, 'epoch': 'ms'}
+        if self.chunk_size:
+            payload['chunked'] = 'true'
+            payload['chunk_size'] = self.chunk_size
+        return self.pool.post(url=self.url,
+                              params=payload,
+                              data={'q': req},
+                              stream=bool(self.chunk_size))
 
-        profiler = Profiler()
+    def series(self, resp, req):
+        """Generator of all the series in the results of the InfluxDB response.
 
-        metrics_s = "\"" + "\", \"".join(metrics) + "\""
-        req = "select mean(value) from {metrics} " \
-              "where cluster = '{cluster}' " \
-              "and (( job = 'job_{job}' and time > now() - {period} ) or" \
-              " ( job = 'none' and plugin = 'cuda' and time >= {start_time}000000000 and time <= {end_time}000000000 and node = '{nodes}' )) " \
-              "group by time({time_group}), node fill(0)" \
-              .format(metrics=metrics_s,
-                      period=period,
-                      cluster=cluster,
-                      job=job.jobid,
-                      nodes=job.nodeset,
-                      start_time=job.start_time,
-                      end_time=job.end_time,
-                      time_group=time_group)
+           In streaming mode, InfluxDB sends a sequence of JSON documents
+           separated by newlines, each one with at most chunk_size points. The
+           documents are parsed one by one as they are downloaded so that only
+           one chunk is kept in memory at a time. The series of a node can be
+           split over several chunks.
+        """
 
-        logger.debug("req influx: %s", req)
-        profiler.meta('metrics_req', req)
+        if self.chunk_size:
+            docs = (json.loads(line) for line in resp.iter_lines() if line)
+        else:
+            docs = [json.loads(resp.text)]
 
-        payload = {'db': self.db, 'q': req, 'epoch': 'ms'}
+        for doc in docs:
+            for result in doc['results']:
+                if 'error' in result:
+                    logger.error("Error in one result for query %s: %s",
+                                 req, result['error'])
+                if 'series' in result:
+                    series = result['series']
+                else:
+                    logger.warn("No series in one result for query: %s", req)
+                    series = {}
+                for serie in series:
+                    serie['statement_id'] = result.get('statement_id', 0)
+                    yield serie
+
+    def check(self, resp, cluster, job):
 
-        profiler.start('metrics_req')
-        resp = requests.get(url=self.url, params=payload)
-        profiler.stop('metrics_req')
         if resp.status_code == 404:
+            resp.close()
             raise LookupError("metrics not found for job {job} on cluster "
                               "{cluster}"
                               .format(job=job.jobid,
                                       cluster=cluster))
 
-        profiler.start('metrics_proc')
-
-        json_data = json.loads(resp.text)
+    def aggregate(self, resp, req, aggregator):
+        """Feed the aggregator with all the series of the response."""
 
         # data is a dict with 'results' key that is itself a list of dict with
         # 'series' key that is as well a list of dict, one dict per node/node
@@ -163,37 +212,439 @@ class MetricsDB(object):
         #   ]}
         # ]}
 
-        results = {}
-        nodeset = NodeSet()
-        for result in json_data['results']:
-            if 'series' in result:
-                series = result['series']
+        try:
+            for serie in self.series(resp, req):
+                aggregator.add(serie['name'],
+                               serie['tags']['node'].encode('utf-8'),
+                               serie['values'])
+        finally:
+            resp.close()
+
+    def window(self, job, period):
+        """Returns the (start, end, interval) tuple of the time window of the
+           job metrics for the period, as epochs and interval in seconds.
+
+           The window is the time range of the job, restricted to its last
+           part for periods with a duration. The interval of the time buckets
+           is the smallest multiple of min_interval that gives at most
+           max_points points in the window. With LTTB downsampling, the
+           metrics are requested with oversampling times more points.
+        """
+
+        end = job.end_time
+        duration = periods[period]
+        if duration is None:
+            start = job.start_time
+        else:
+            start = max(job.start_time, end - duration)
+
+        points = self.max_points
+        if self.downsampling == 'lttb':
+            points *= self.oversampling
+        return (start, end, self.interval(start, end, points))
+
+    def batch_window(self, jobs, period):
+        """Returns the (start, end, interval) tuple of the time window
+           covering the metrics of all the jobs for the period. The window
+           ends with the latest job and the interval gives at most
+           batch_max_points points."""
+
+        end = max([job.end_time for job in jobs])
+        start = min([job.start_time for job in jobs])
+        duration = periods[period]
+        if duration is not None:
+            start = max(start, end - duration)
+        return (start, end, self.interval(start, end, self.batch_max_points))
+
+    def interval(self, start, end, points):
+        """Returns the smallest multiple of min_interval that gives at most
+           points time buckets between start and end."""
+
+        slots = math.ceil(float(end - start) / points / self.min_interval)
+        return max(int(slots), 1) * self.min_interval
+
+    def conditions(self, cluster, job, window, since=None, nodeset=None):
+        """Returns the conditions of the where clause to select the points of
+           the job in the time window. If nodeset is given, the points are
+           restricted to these nodes, the CUDA metrics are then only selected
+           on these nodes instead of all the nodes of the job."""
+
+        if nodeset is not None:
+            shard_s = "and node =~ {nodes} ".format(nodes=nodes_regex(nodeset))
+        else:
+            shard_s = ""
+            nodeset = job.nodeset
+        return "cluster = '{cluster}' " \
+               "and time >= {start}000000000 and time <= {end}000000000 " \
+               "and ( job = 'job_{job}' or" \
+               " ( job = 'none' and plugin = 'cuda' and node =~ {nodes} )) " \
+               "{since}" \
+               "{shard}" \
+               .format(since=since_condition(since),
+                       shard=shard_s,
+                       cluster=cluster,
+                       job=job.jobid,
+                       nodes=nodes_regex(nodeset),
+                       start=window[0],
+                       end=window[1])
+
+    def metrics_req(self, cluster, job, metrics, window, since=None,
+                    nodeset=None):
+        """Returns the InfluxDB query of the metrics of the job, with one
+           series per node and metric."""
+
+        return self.select_req(metrics,
+                               self.conditions(cluster, job, window, since,
+                                               nodeset),
+                               window)
+
+    def select_req(self, metrics, conditions, window):
+        """Returns the InfluxDB query of the metrics selected by the
+           conditions, with one series per node and metric."""
+
+        metrics_s = "\"" + "\", \"".join(metrics) + "\""
+        return "select mean(value) from {metrics} " \
+               "where {conditions}" \
+               "group by time({interval}s), node fill(0)" \
+               .format(metrics=metrics_s,
+                       conditions=conditions,
+                       interval=window[2])
+
+    def pushdown_req(self, cluster, job, metrics, window, since=None):
+        """Returns the InfluxDB query of the metrics of the job summed over
+           all nodes by InfluxDB, with one statement per metric. The metrics
+           with last value semantics, reported by several batch servers, are
+           not summed, their maximum value is selected instead.
+
+           The outer queries need explicit time bounds, they are the same as
+           the inner queries.
+        """
+
+        conditions = self.conditions(cluster, job, window, since)
+
+        statements = []
+        for metric in metrics:
+            if metric in self.last_metrics:
+                function = 'max'
             else:
-                logger.warn("No series in one result for query: %s", req)
-                series = {}
-
-            for serie in series:
-                metric = serie['name']
-                node = serie['tags']['node'].encode('utf-8')
-
-                if node not in nodeset:
-                    nodeset.update(node)
-
-                for pair in serie['values']:
-                    timestamp = str(pair[0])
-                    value = pair[1]
-                    if timestamp not in results:
-                        # init all values for timestamp to 0
-                        results[timestamp] = [0]*len(metrics)
-                    # The cpus/nodes metrics can be produced by several
-                    # batch servers and thus returned multiple times by
-                    # InfluxDB server in the result of the request. We
-                    # must take care to not add the multiple results of
-                    # this metric here!
-                    if metric in ['cpus', 'nodes']:
-                        results[timestamp][metrics.index(metric)] = value
-                    else:
-                        results[timestamp][metrics.index(metric)] += value
+                function = 'sum'
+            statements.append(
+                "select {function}(\"mean\") from "
+                "(select mean(value) from \"{metric}\" "
+                "where {conditions}"
+                "group by time({interval}s), node fill(0)) "
+                "where time >= {start}000000000 and time <= {end}000000000 "
+                "{since}"
+                "group by time({interval}s) fill(0)"
+                .format(function=function,
+                        metric=metric,
+                        conditions=conditions,
+                        start=window[0],
+                        end=window[1],
+                        since=since_condition(since),
+                        interval=window[2]))
+        return "; ".join(statements)
+
+    def producers_req(self, cluster, job, metrics, window, since=None):
+        """Returns the InfluxDB query of the nodes that produced the metrics
+           of the job, with only one point per node and metric."""
+
+        metrics_s = "\"" + "\", \"".join(metrics) + "\""
+        return "select count(value) from {metrics} " \
+               "where {conditions}" \
+               "group by node" \
+               .format(metrics=metrics_s,
+                       conditions=self.conditions(cluster, job, window,
+                                                  since))
+
+    def batch_req(self, cluster, jobids, metrics, window):
+        """Returns the InfluxDB query of the metrics of all the jobs summed
+           over their nodes by InfluxDB, with one statement per metric and one
+           series per job in every statement. The metrics with last value
+           semantics are not summed, their maximum value is selected
+           instead.
+
+           The GPU metrics are not tagged with the job, they can not be
+           selected this way.
+        """
+
+        jobs_s = "/^job_({jobs})$/".format(
+            jobs='|'.join([str(jobid) for jobid in jobids]))
+        statements = []
+        for metric in metrics:
+            if metric in self.last_metrics:
+                function = 'max'
+            else:
+                function = 'sum'
+            statements.append(
+                "select {function}(\"mean\") from "
+                "(select mean(value) from \"{metric}\" "
+                "where cluster = '{cluster}' "
+                "and time >= {start}000000000 and time <= {end}000000000 "
+                "and job =~ {jobs} "
+                "group by time({interval}s), node, job fill(0)) "
+                "where time >= {start}000000000 and time <= {end}000000000 "
+                "group by time({interval}s), job fill(0)"
+                .format(function=function,
+                        metric=metric,
+                        cluster=cluster,
+                        jobs=jobs_s,
+                        start=window[0],
+                        end=window[1],
+                        interval=window[2]))
+        return "; ".join(statements)
+
+    def fetch(self, cluster, job, metrics, req):
+        """Send the request to InfluxDB and returns the aggregator fed with
+           the series of the response."""
+
+        resp = self.query(req)
+        self.check(resp, cluster, job)
+        aggregator = Aggregator(metrics, self.last_metrics)
+        self.aggregate(resp, req, aggregator)
+        return aggregator
+
+    def get_metrics_results(self, cluster, job, metrics, window, since=None):
+        """Get the metrics of the job on the cluster in the time window
+           returned by window().
+
+           It sends an HTTP request to InfluxDB service to download the metric
+           values in JSON format and returns a list. If since is given (epoch
+           in ms), only the time buckets starting at this time or later are
+           requested. The LTTB downsampling is applied on the whole window
+           only, incremental results are returned as is.
+        """
+
+        profiler = Profiler()
+        profiler.meta('metrics_plan', self.plan)
+        profiler.meta('metrics_interval', "%ds" % (window[2]))
+
+        if self.plan == 'pushdown':
+            (results, nodeset) = \
+                self.get_pushdown_results(cluster, job, metrics, window,
+                                          since)
+        elif self.shard_size and len(job.nodeset) > self.shard_size:
+            (results, nodeset) = \
+                self.get_sharded_results(cluster, job, metrics, window,
+                                         since)
+        else:
+            (results, nodeset) = \
+                self.get_nodes_results(cluster, job, metrics, window, since)
+
+        if self.downsampling == 'lttb' and since is None:
+            profiler.start('metrics_downsampling')
+            results = lttb(results, self.max_points)
+            profiler.stop('metrics_downsampling')
+
+        return (results, nodeset)
+
+    def get_nodes_results(self, cluster, job, metrics, window, since):
+        """Send one query to InfluxDB for all the nodes of the job and sum
+           the series of the nodes."""
+
+        profiler = Profiler()
+
+        req = self.metrics_req(cluster, job, metrics, window, since)
+
+        logger.debug("req influx: %s", req)
+        profiler.meta('metrics_req', req)
+
+        profiler.start('metrics_req')
+        resp = self.query(req)
+        profiler.stop('metrics_req')
+        profiler.meta('pool_influxdb', self.pool.dump_stats())
+        self.check(resp, cluster, job)
+
+        profiler.start('metrics_proc')
+        aggregator = Aggregator(metrics, self.last_metrics)
+        self.aggregate(resp, req, aggregator)
+        results = aggregator.results()
+        nodeset = aggregator.nodeset
+        profiler.stop('metrics_proc')
+
+        return (results, nodeset)
+
+    def get_sharded_results(self, cluster, job, metrics, window, since):
+        """Split the nodeset of the job in shards of shard_size nodes and
+           send one query per shard concurrently in the pool of workers. The
+           partial sums of all shards are then merged.
+
+           The metrics with last value semantics are not produced by the
+           compute nodes of the job. They are requested in a separate query
+           without restriction on nodes. No shard is requested if there are
+           only such metrics.
+        """
+
+        profiler = Profiler()
 
+        nodes = list(job.nodeset)
+        sum_metrics = [metric for metric in metrics
+                       if metric not in self.last_metrics]
+        reqs = []
+        if sum_metrics:
+            reqs = [self.metrics_req(cluster, job, sum_metrics, window, since,
+                                     nodes[idx:idx+self.shard_size])
+                    for idx in range(0, len(nodes), self.shard_size)]
+        shards = len(reqs)
+        if len(sum_metrics) < len(metrics):
+            reqs.append(self.metrics_req(cluster, job,
+                                         [metric for metric in metrics
+                                          if metric in self.last_metrics],
+                                         window, since))
+        logger.debug("%d sharded req influx, first: %s", len(reqs), reqs[0])
+        profiler.meta('metrics_req', reqs[0])
+        profiler.meta('metrics_shards', str(shards))
+
+        profiler.start('metrics_req')
+        aggregators = self.get_workers_pool().map(
+            Profiler.propagate(
+                lambda req: self.fetch(cluster, job, metrics, req)), reqs)
+        profiler.stop('metrics_req')
+        profiler.meta('pool_influxdb', self.pool.dump_stats())
+
+        profiler.start('metrics_proc')
+        aggregator = aggregators[0]
+        for partial in aggregators[1:]:
+            aggregator.merge(partial)
+        results = aggregator.results()
+        nodeset = aggregator.nodeset
         profiler.stop('metrics_proc')
+
         return (results, nodeset)
+
+    def get_pushdown_results(self, cluster, job, metrics, window, since):
+        """Let InfluxDB sum the metrics over all nodes so that it sends one
+           series per metric instead of one series per node and metric. The
+           nodes that produced the metrics are requested in a separate cheap
+           query.
+        """
+
+        profiler = Profiler()
+
+        req = self.pushdown_req(cluster, job, metrics, window, since)
+
+        logger.debug("req influx: %s", req)
+        profiler.meta('metrics_req', req)
+
+        profiler.start('metrics_req')
+        resp = self.query(req)
+        profiler.stop('metrics_req')
+        self.check(resp, cluster, job)
+
+        profiler.start('metrics_proc')
+        aggregator = Aggregator(metrics, self.last_metrics)
+        try:
+            for serie in self.series(resp, req):
+                # There is one statement per metric, in the same order.
+                aggregator.add(metrics[serie['statement_id']],
+                               None,
+                               serie['values'])
+        finally:
+            resp.close()
+        profiler.stop('metrics_proc')
+
+        req = self.producers_req(cluster, job, metrics, window, since)
+        logger.debug("req influx: %s", req)
+
+        profiler.start('metrics_producers_req')
+        resp = self.query(req)
+        self.check(resp, cluster, job)
+        try:
+            for serie in self.series(resp, req):
+                # only the node is relevant in these series
+                aggregator.add(serie['name'],
+                               serie['tags']['node'].encode('utf-8'),
+                               [])
+        finally:
+            resp.close()
+        profiler.stop('metrics_producers_req')
+        profiler.meta('pool_influxdb', self.pool.dump_stats())
+
+        return (aggregator.results(), aggregator.nodeset)
+
+
+    def get_nodes_matrix(self, cluster, job, metrics, window):
+        """Get the metrics of every node of the job on the cluster in the time
+           window returned by window(), without summing them. Returns the
+           NodesMatrix."""
+
+        profiler = Profiler()
+        profiler.meta('metrics_interval', "%ds" % (window[2]))
+
+        req = self.metrics_req(cluster, job, metrics, window)
+        logger.debug("req influx: %s", req)
+        profiler.meta('metrics_req', req)
+
+        profiler.start('metrics_req')
+        resp = self.query(req)
+        profiler.stop('metrics_req')
+        profiler.meta('pool_influxdb', self.pool.dump_stats())
+        self.check(resp, cluster, job)
+
+        profiler.start('metrics_proc')
+        matrix = NodesMatrix(metrics, job.nodeset)
+        self.aggregate(resp, req, matrix)
+        matrix.build()
+        profiler.stop('metrics_proc')
+
+        return matrix
+
+    def get_batch_results(self, cluster, jobids, metrics, window):
+        """Get the metrics of all the jobs on the cluster in the time window
+           returned by batch_window() with one query. Returns a dict with job
+           IDs as keys and dicts of metrics in the same format as
+           get_metrics_results() as values.
+        """
+
+        profiler = Profiler()
+        profiler.meta('metrics_interval', "%ds" % (window[2]))
+
+        req = self.batch_req(cluster, jobids, metrics, window)
+        logger.debug("req influx: %s", req)
+        profiler.meta('metrics_req', req)
+
+        profiler.start('metrics_req')
+        resp = self.query(req)
+        profiler.stop('metrics_req')
+        if resp.status_code == 404:
+            resp.close()
+            raise LookupError("metrics not found for jobs on cluster "
+                              "{cluster}".format(cluster=cluster))
+        profiler.meta('pool_influxdb', self.pool.dump_stats())
+
+        # Split the series of every job in its own aggregator in one pass.
+        profiler.start('metrics_proc')
+        aggregators = {jobid: Aggregator(metrics, self.last_metrics)
+                       for jobid in jobids}
+        try:
+            for serie in self.series(resp, req):
+                # There is one statement per metric, in the same order.
+                jobid = int(serie['tags']['job'][len('job_'):])
+                aggregators[jobid].add(metrics[serie['statement_id']],
+                                       None,
+                                       serie['values'])
+        finally:
+            resp.close()
+        results = {jobid: aggregator.results()
+                   for jobid, aggregator in aggregators.iteritems()}
+        profiler.stop('metrics_proc')
+
+        return results
+
+
+def since_condition(since):
+    """Returns the condition of the where clause to select the points at or
+       after the since timestamp in ms, or an empty string if since is
+       None."""
+
+    if since is None:
+        return ""
+    return "and time >= {since}ms ".format(since=since)
+
+
+def nodes_regex(nodeset):
+    """Returns the InfluxDB regular expression that matches the nodes of the
+       nodeset."""
+
+    return "/^({nodes})$/".format(nodes='|'.join([re.escape(node)
+                                                  for node in nodeset]))
@@ -0,0 +1,113 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+"""The NodesMatrix class keeps the series of every node of a job instead of
+   summing them, as a matrix of metrics x nodes x timestamps. It detects the
+   nodes whose metrics deviate the most from the other nodes of the job. It
+   requires NumPy."""
+
+import warnings
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class NodesMatrix(object):
+
+    def __init__(self, metrics, nodeset):
+
+        self.metrics = metrics
+        # all nodes of the job, including those without metrics
+        self.nodes = list(nodeset)
+        self.index = {node: idx for (idx, node) in enumerate(self.nodes)}
+        # (metric index, node index) -> array of [timestamp, value]
+        self.series = {}
+        self.timestamps = None
+        self.values = None
+
+    def add(self, metric, node, values):
+        """Add the series of values, as a list of [timestamp, value] pairs,
+           of the metric on the node. The metrics and nodes out of the matrix
+           are ignored."""
+
+        if metric not in self.metrics or node not in self.index or not values:
+            return
+        try:
+            points = np.array(values, dtype=np.float64)
+        except TypeError:
+            # InfluxDB sends null values for empty buckets without fill
+            points = np.array([[timestamp, np.nan if value is None else value]
+                               for (timestamp, value) in values],
+                              dtype=np.float64)
+        key = (self.metrics.index(metric), self.index[node])
+        if key in self.series:
+            # the series of a node can be split over several chunks
+            points = np.concatenate((self.series[key], points))
+        self.series[key] = points
+
+    def build(self):
+        """Build the matrix of values out of the series added so far. The
+           values of the nodes without points at a timestamp are NaN."""
+
+        if self.series:
+            self.timestamps = np.unique(np.concatenate(
+                [points[:, 0] for points in self.series.itervalues()])) \
+                .astype(np.int64)
+        else:
+            self.timestamps = np.zeros(0, dtype=np.int64)
+        self.values = np.full((len(self.metrics),
+                               len(self.nodes),
+                               len(self.timestamps)),
+                              np.nan, dtype=np.float32)
+        for ((metric, node), points) in self.series.iteritems():
+            columns = np.searchsorted(self.timestamps,
+                                      points[:, 0].astype(np.int64))
+            self.values[metric, node, columns] = points[:, 1]
+        self.series = {}
+
+    def outliers(self, k):
+        """Returns a dict with the metrics as keys and the list of the k nodes
+           whose metric deviates the most from the median of the nodes of the
+           job as values. The deviation of a node is the mean difference over
+           time with the median of all nodes. Its score is the ratio of the
+           deviation to the median absolute deviation of all nodes. The nodes
+           without metric or that do not deviate at all are ignored, there
+           is no outlier when all the nodes behave identically."""
+
+        with warnings.catch_warnings():
+            # all-NaN slices for the nodes and timestamps without metric
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(self.values, axis=1)
+            deviations = np.nanmean(self.values - median[:, np.newaxis, :],
+                                    axis=2)
+            scale = np.nanmedian(np.abs(deviations), axis=1)
+        scores = np.abs(deviations) / \
+            np.where(scale > 0, scale, 1)[:, np.newaxis]
+        scores = np.where(np.isnan(scores), -1, scores)
+
+        result = {}
+        for (idx, metric) in enumerate(self.metrics):
+            top = np.argsort(-scores[idx], kind='mergesort')[:k]
+            result[metric] = [{'node': self.nodes[node],
+                               'deviation': float(deviations[idx, node]),
+                               'score': float(scores[idx, node])}
+                              for node in top if scores[idx, node] > 0]
+        return result
@@ -0,0 +1,95 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+"""The Prefetcher class is a background thread of the WSGI process that
+   periodically requests the params of all the current jobs of every cluster,
+   with one request per cluster, to fill the jobs params cache before the
+   dashboards request them."""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import threading
+
+from jobmetrics.Profiler import Profiler
+
+
+class Prefetcher(threading.Thread):
+
+    def __init__(self, ctx, clusters, jobs_cache, interval):
+
+        super(Prefetcher, self).__init__(name='jobmetrics-prefetcher')
+        self.daemon = True
+        self.ctx = ctx
+        self.clusters = clusters
+        self.jobs_cache = jobs_cache
+        self.interval = interval
+        self.stopped = threading.Event()
+        # cluster -> set of the jobids current at previous cycle
+        self.current = {}
+
+    def stop(self):
+
+        self.stopped.set()
+
+    def run(self):
+
+        logger.info("prefetching jobs of clusters %s every %ds",
+                    ','.join(self.clusters), self.interval)
+        while not self.stopped.is_set():
+            for cluster in self.clusters:
+                if self.stopped.is_set():
+                    break
+                try:
+                    self.prefetch(cluster)
+                except Exception as err:
+                    logger.warning("error while prefetching jobs of cluster "
+                                   "%s: %s", cluster, err)
+            self.stopped.wait(self.interval)
+
+    def prefetch(self, cluster):
+        """Put the params of all the current jobs of the cluster in cache.
+           They are valid until the next cycle. The jobs that are not current
+           anymore are requested one by one to get their final state."""
+
+        # the timers of the requests are not reported anywhere
+        Profiler.reset()
+
+        api = self.ctx.slurm_api(cluster)
+        jobs = api.jobs()
+        self.ctx.cache.write()
+        # twice the interval to avoid expiration before next cycle
+        ttl = 2 * self.interval
+        for jobid, params in jobs.iteritems():
+            self.jobs_cache.put(cluster, jobid, params, ttl)
+
+        previous = self.current.get(cluster, set())
+        self.current[cluster] = set(jobs.keys())
+        for jobid in previous - self.current[cluster]:
+            try:
+                self.jobs_cache.put(cluster, jobid, api.job_params(jobid))
+            except IndexError:
+                # the job has been purged from slurm
+                self.jobs_cache.invalidate(cluster, jobid)
+            except Exception as err:
+                logger.debug("unable to get final params of job %d: %s",
+                             jobid, err)
+                self.jobs_cache.invalidate(cluster, jobid)
+        logger.debug("%d jobs prefetched on cluster %s, %d finished",
+                     len(jobs), cluster, len(previous - self.current[cluster]))
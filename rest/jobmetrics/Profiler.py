@@ -18,65 +18,102 @@
 # You should have received a copy of the GNU General Public License
 # along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
 
-"""The Profiler class is a Singleton object (using the so-called metaclass)
-   used across all Jobmetrics backend application to manage a set of internal
-   profiling timers and metadata."""
+"""The Profiler class manages a set of internal profiling timers and
+   metadata for the request being served. Every thread has its own Profiler
+   object (using the so-called metaclass) so that the concurrent requests of
+   the same process do not mix their timers. The workers threads of a request
+   are bound to the Profiler of the request."""
 
 import time
-import thread
+import threading
 
 
-class Singleton(type):
+class ContextLocal(type):
 
-    """ Singleton thread-safe metaclass """
+    """ Metaclass giving one instance per thread """
 
-    __instances = {}
-    __lockObj = thread.allocate_lock()  # lock object
+    def __init__(cls, name, bases, attrs):
 
-    def __call__(mcs, *args, **kwargs):
-        mcs.__lockObj.acquire()
-        try:
-            if mcs not in mcs.__instances:
-                mcs.__instances[mcs] = super(Singleton, mcs) \
-                    .__call__(*args, **kwargs)
-        finally:
-            #  Exit from critical section whatever happens
-            mcs.__lockObj.release()
+        super(ContextLocal, cls).__init__(name, bases, attrs)
+        cls.local = threading.local()
 
-        return mcs.__instances[mcs]
+    def __call__(cls, *args, **kwargs):
 
-    def initialized(mcs):
+        instance = getattr(cls.local, 'instance', None)
+        if instance is None:
+            instance = super(ContextLocal, cls).__call__(*args, **kwargs)
+            cls.local.instance = instance
+        return instance
 
-        return mcs in mcs.__instances
+    def initialized(cls):
+
+        return getattr(cls.local, 'instance', None) is not None
+
+    def reset(cls):
+        """Drop the instance of the current thread, the next call gives a new
+           one."""
+
+        cls.local.instance = None
+
+    def bind(cls, instance):
+        """Set the instance of the current thread."""
+
+        cls.local.instance = instance
+
+    def propagate(cls, func):
+        """Returns a function that runs func with the instance of the current
+           thread bound in the thread running it, typically a worker of a
+           pool."""
+
+        instance = cls()
+
+        def bound(*args, **kwargs):
+            cls.bind(instance)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                cls.reset()
+        return bound
 
 
 class Profiler(object):
 
-    __metaclass__ = Singleton
+    __metaclass__ = ContextLocal
 
     def __init__(self):
 
         self.metadata = {}
         self.timers = {}
         self.starts = {}
+        # the workers threads of a request may share this object
+        self.lock = threading.Lock()
 
     def meta(self, key, value):
 
-        self.metadata[key] = value
+        with self.lock:
+            self.metadata[key] = value
 
     def start(self, timer):
 
-        self.starts[timer] = time.time()
-        self.timers[timer] = float(-1)
+        with self.lock:
+            self.starts[timer] = time.time()
+            self.timers[timer] = float(-1)
 
     def stop(self, timer):
 
-        if timer not in self.timers:
-            return  # ignore silently
+        with self.lock:
+            if timer not in self.timers:
+                return  # ignore silently
 
-        self.timers[timer] = time.time() - self.starts[timer]
+            self.timers[timer] = time.time() - self.starts[timer]
 
     def dump(self):
-
-        return {'timers': self.timers,
-                'metadata': self.metadata}
+        """Returns the timers and the metadata. The timers still running, such
+           as the request and serialization timers while the response is
+           built, are left out."""
+
+        with self.lock:
+            return {'timers': {timer: value
+                               for (timer, value) in self.timers.iteritems()
+                               if value >= 0},
+                    'metadata': dict(self.metadata)}
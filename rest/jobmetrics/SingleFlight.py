@@ -0,0 +1,91 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+"""The SingleFlight class coalesces identical concurrent requests to the
+   upstream services. The first caller of a key runs the fetch while the
+   others wait for its result. The result is then reused by the callers of
+   the same key during a short freshness window."""
+
+import time
+import threading
+
+
+class Flight(object):
+
+    def __init__(self):
+
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.expiration = None
+
+
+class SingleFlight(object):
+
+    def __init__(self, freshness):
+
+        self.freshness = freshness
+        self.lock = threading.Lock()
+        # key -> Flight in progress or done and still fresh
+        self.flights = {}
+
+    def do(self, key, func):
+        """Returns the result of func() for the key and a boolean which is
+           True if the result comes from another caller. The exceptions raised
+           by func() are raised to all the callers waiting for the result but
+           they are never reused by later callers."""
+
+        with self.lock:
+            self.expire()
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight()
+                self.flights[key] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return (flight.result, True)
+
+        try:
+            flight.result = func()
+        except Exception as err:
+            flight.error = err
+            with self.lock:
+                self.flights.pop(key, None)
+            raise
+        finally:
+            flight.expiration = time.time() + self.freshness
+            flight.done.set()
+
+        if self.freshness <= 0:
+            with self.lock:
+                self.flights.pop(key, None)
+        return (flight.result, False)
+
+    def expire(self):
+        """Remove the done flights out of the freshness window. Must be called
+           with lock acquired."""
+
+        now = time.time()
+        for key in [key for (key, flight) in self.flights.iteritems()
+                    if flight.done.is_set() and flight.expiration < now]:
+            del self.flights[key]
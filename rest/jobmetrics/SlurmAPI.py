@@ -21,21 +21,25 @@
 import logging
 logger = logging.getLogger(__name__)
 import json
-import requests
-from requests.exceptions import ConnectionError
+import threading
+from requests.exceptions import ConnectionError, Timeout
 from jobmetrics.Profiler import Profiler
 
 
 class SlurmAPI(object):
 
-    def __init__(self, conf, cluster, cache):
+    def __init__(self, conf, cluster, store):
 
         self.cluster = cluster
         self.base_url = conf.api(cluster)
-        self.cache = cache
+        self.store = store
+        self.cache = store.get(cluster)
+        # lock to avoid concurrent logins of threads on the same cluster
+        self.lock = threading.Lock()
         self.auth_login = conf.login(cluster)
         self.auth_password = conf.password(cluster)
         self.auth_enabled = conf.auth_enabled(cluster)
+        self.pool = conf.http_pool(cluster)
         if conf.tls_verify:
             self.ca_filepath = conf.ca_filepath
         else:
@@ -44,10 +48,10 @@ class SlurmAPI(object):
         logger.debug("Cluster %s (ca_filepath: %s)",
                      self.cluster, self.ca_filepath)
 
-        if cache.empty is None:
-            self.auth_token = None
-        else:
-            self.auth_token = cache.token
+    @property
+    def auth_token(self):
+
+        return self.cache.token
 
     @property
     def auth_as_guest(self):
@@ -77,9 +81,9 @@ class SlurmAPI(object):
                     logger.warn("No password provided")
                 payload = {"login": self.auth_login,
                            "password": self.auth_password}
-            resp = requests.post(url=url,
-                                 json=payload,
-                                 verify=self.ca_filepath)
+            resp = self.pool.post(url=url,
+                                  json=payload,
+                                  verify=self.ca_filepath)
         except ConnectionError as err:
             logger.warn("Connection Error args: %s", err.args)
             # reformat the exception
@@ -98,7 +102,8 @@ class SlurmAPI(object):
             raise ValueError("not JSON data for POST {url}"
                              .format(url=url))
 
-        self.auth_token = data['id_token']
+        # update token in cache
+        self.cache.token = data['id_token']
 
     def ensure_auth(self):
 
@@ -112,15 +117,16 @@ class SlurmAPI(object):
         if self.auth_enabled is False:
             return
 
-        # At this point, auth is enabled and we do not have token.
-        self.login()
-        # update token in cache
-        self.cache.token = self.auth_token
+        # At this point, auth is enabled and we do not have token. Another
+        # thread may be logging in, check again the token under lock.
+        with self.lock:
+            if self.auth_token is None:
+                self.login()
 
-    def job_params(self, job, firsttime=True):
-        """Request the Slurm REST API of the cluster to get Job params. Raises
-           IndexError if job is not found or ValueError if not well formatted
-           JSON data sent by the API.
+    def get(self, path, firsttime=True):
+        """Send authenticated GET request on the path of the Slurm REST API of
+           the cluster and returns the response. Raises ValueError in case of
+           connection error.
         """
 
         profiler = Profiler()
@@ -128,48 +134,79 @@ class SlurmAPI(object):
         self.ensure_auth()
         profiler.stop('slurm_auth')
 
-        url = "{base}/job/{job}".format(base=self.base_url, job=job)
+        url = "{base}/{path}".format(base=self.base_url, path=path)
+        # keep the token sent in the request to detect a renewal in case of
+        # authentication failure
+        token = self.auth_token
 
         try:
             profiler.start('slurm_req')
             if self.auth_enabled is True:
-                headers = {'Authorization': "Bearer %s" % self.auth_token}
-                resp = requests.get(url=url,
-                                    headers=headers,
-                                    verify=self.ca_filepath)
+                headers = {'Authorization': "Bearer %s" % token}
+                resp = self.pool.get(url=url,
+                                     headers=headers,
+                                     verify=self.ca_filepath)
             else:
-                resp = requests.get(url=url, verify=self.ca_filepath)
+                resp = self.pool.get(url=url, verify=self.ca_filepath)
             profiler.stop('slurm_req')
-        except ConnectionError as err:
+            profiler.meta('pool_slurm', self.pool.dump_stats())
+        except (ConnectionError, Timeout) as err:
             # reformat the exception
             raise ValueError("connection error while trying to connect to "
                              "{url}: {error}".format(url=url, error=err))
 
-        if resp.status_code == 404:
-            raise IndexError("job ID {jobid} not found in API {api}"
-                             .format(jobid=job, api=self.base_url))
-
         if resp.status_code == 403:
             logger.debug("Error 403 received: %s", resp.content)
             if firsttime:
                 # We probably get this error because of invalidated token.
-                # Invalidate cache, trigger check_auth() and call this method
-                # again.
-                logger.info("token in cache invalidated")
-                self.auth_token = None
-                self.auth_enabled = None
-                self.cache.invalidate()
-                return self.job_params(job, firsttime=False)
+                # Another thread or process may have already renewed it.
+                # Otherwise, invalidate the cache of this cluster only. Then
+                # trigger ensure_auth() and call this method again.
+                with self.lock:
+                    self.store.refresh()
+                    if self.auth_token == token:
+                        logger.info("token in cache invalidated")
+                        self.cache.invalidate()
+                return self.get(path, firsttime=False)
             else:
                 # We have already tried twice. This means the app is not able
                 # to auth on slurm-web API with current params. Just throw the
                 # error and give-up here.
                 raise Exception("get 403/forbidden from {url} with new token"
                                 .format(url=self.base_url))
+        return resp
+
+    @staticmethod
+    def load(resp):
+        """Returns the JSON data of the response. Raises ValueError if not
+           well formatted."""
+
         try:
-            json_job = json.loads(resp.text)
+            return json.loads(resp.text)
         except ValueError:
             # reformat the exception
             raise ValueError("not JSON data for GET {url}"
-                             .format(url=url))
-        return json_job
+                             .format(url=resp.url))
+
+    def job_params(self, job):
+        """Request the Slurm REST API of the cluster to get Job params. Raises
+           IndexError if job is not found or ValueError if not well formatted
+           JSON data sent by the API.
+        """
+
+        resp = self.get("job/{job}".format(job=job))
+        if resp.status_code == 404:
+            raise IndexError("job ID {jobid} not found in API {api}"
+                             .format(jobid=job, api=self.base_url))
+        return self.load(resp)
+
+    def jobs(self):
+        """Request the Slurm REST API of the cluster to get the params of all
+           its current jobs in one request. Returns a dict with job IDs as
+           keys. Raises ValueError if not well formatted JSON data sent by the
+           API.
+        """
+
+        resp = self.get("jobs")
+        return {int(jobid): params
+                for jobid, params in self.load(resp).iteritems()}
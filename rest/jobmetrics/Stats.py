@@ -0,0 +1,128 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+"""The Stats class is the registry of the statistics of a WSGI process
+   aggregated over all the requests served since its start: the latency
+   histograms of the processing stages and the numbers of requests and errors
+   per cluster. They are exported in Prometheus text format."""
+
+import threading
+from bisect import bisect_left
+
+# upper bounds of the latency histograms buckets, in seconds
+buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+
+class Histogram(object):
+
+    def __init__(self):
+
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+
+        self.counts[bisect_left(buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Returns the list of (upper bound, cumulative count) of the
+           buckets."""
+
+        bounds = ["%g" % (bound) for bound in buckets] + ['+Inf']
+        result = []
+        total = 0
+        for (bound, count) in zip(bounds, self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def escape(value):
+
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+                .replace('\n', '\\n')
+
+
+class Stats(object):
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        # stage -> Histogram
+        self.stages = {}
+        # (cluster, status code) -> count
+        self.requests = {}
+        # cluster -> count
+        self.errors = {}
+
+    def record(self, cluster, status, timers):
+        """Record a request on the cluster answered with the status code and
+           the durations of its stages in the timers dict. The stages not
+           stopped (with negative duration) are ignored."""
+
+        with self.lock:
+            key = (cluster, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if status >= 400:
+                self.errors[cluster] = self.errors.get(cluster, 0) + 1
+            for (stage, duration) in timers.iteritems():
+                if duration < 0:
+                    continue
+                if stage not in self.stages:
+                    self.stages[stage] = Histogram()
+                self.stages[stage].observe(duration)
+
+    def dump(self):
+        """Returns the statistics in Prometheus text format."""
+
+        lines = []
+        with self.lock:
+            name = 'jobmetrics_stage_duration_seconds'
+            lines.append("# HELP %s Duration of the processing stages."
+                         % (name))
+            lines.append("# TYPE %s histogram" % (name))
+            for stage in sorted(self.stages.keys()):
+                histogram = self.stages[stage]
+                labels = 'stage="%s"' % (escape(stage))
+                for (bound, count) in histogram.cumulative():
+                    lines.append("%s_bucket{%s,le=\"%s\"} %d"
+                                 % (name, labels, bound, count))
+                lines.append("%s_sum{%s} %f" % (name, labels, histogram.sum))
+                lines.append("%s_count{%s} %d"
+                             % (name, labels, histogram.count))
+
+            name = 'jobmetrics_requests_total'
+            lines.append("# HELP %s Number of requests." % (name))
+            lines.append("# TYPE %s counter" % (name))
+            for (cluster, status) in sorted(self.requests.keys()):
+                lines.append("%s{cluster=\"%s\",code=\"%d\"} %d"
+                             % (name, escape(cluster), status,
+                                self.requests[(cluster, status)]))
+
+            name = 'jobmetrics_errors_total'
+            lines.append("# HELP %s Number of requests failed." % (name))
+            lines.append("# TYPE %s counter" % (name))
+            for cluster in sorted(self.errors.keys()):
+                lines.append("%s{cluster=\"%s\"} %d"
+                             % (name, escape(cluster), self.errors[cluster]))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,214 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+"""The JobStream class is a background thread that polls the metrics of a
+   running job and pushes the new time buckets to all the clients subscribed
+   to the job with Server-Sent Events. There is only one polling loop per
+   job, period, selection of metrics and WSGI process whatever the number of
+   subscribers. The StreamRegistry class keeps track of the current
+   streams and bounds their number of clients."""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import Queue
+import threading
+
+from jobmetrics.Conf import periods
+from jobmetrics.JobParams import JobParams
+from jobmetrics.JobData import JobData
+from jobmetrics.Profiler import Profiler
+
+
+class JobStream(threading.Thread):
+
+    def __init__(self, registry, cluster, jobid, period, metrics):
+
+        super(JobStream, self).__init__(
+            name="jobmetrics-stream-%s-%d-%s" % (cluster, jobid, period))
+        self.daemon = True
+        self.registry = registry
+        self.cluster = cluster
+        self.jobid = jobid
+        self.period = period
+        self.metric_names = metrics
+        self.lock = threading.Lock()
+        self.subscribers = []
+        # all time buckets of the window received so far
+        self.metrics = {}
+        self.interval = None
+
+    @property
+    def key(self):
+
+        return (self.cluster, self.jobid, self.period,
+                tuple(self.metric_names))
+
+    def subscribe(self):
+        """Returns the queue of events of a new subscriber. It receives first
+           all the buckets of the window received so far, if any."""
+
+        events = Queue.Queue()
+        with self.lock:
+            if self.metrics:
+                events.put(('metrics', {'data': dict(self.metrics),
+                                        'metrics': self.metric_names,
+                                        'interval': self.interval,
+                                        'reset': True}))
+            self.subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        """Remove the subscriber. Returns True if it was subscribed."""
+
+        with self.lock:
+            if events in self.subscribers:
+                self.subscribers.remove(events)
+                return True
+            return False
+
+    def publish(self, event, data):
+
+        with self.lock:
+            for events in self.subscribers:
+                events.put((event, data))
+
+    def poll(self):
+        """Request the job params and the buckets since the last one received,
+           or all buckets of the window if the interval has changed. Returns
+           the new buckets, True if all buckets have been requested again and
+           the JobParams."""
+
+        ctx = self.registry.ctx
+        since = None
+        if self.metrics:
+            since = max([int(timestamp) for timestamp in self.metrics])
+
+        job = JobParams(self.jobid)
+        job.request_params(ctx.slurm_api(self.cluster), ctx.jobs_cache,
+                           ctx.flights)
+        ctx.cache.write()
+        archive = ctx.metrics_archive(self.cluster, self.metric_names)
+        job_data = JobData(self.cluster, job, self.period,
+                           self.metric_names, since)
+        job_data.request(ctx.db, archive, ctx.flights)
+
+        if since is not None and job_data.interval != self.interval:
+            since = None
+            job_data = JobData(self.cluster, job, self.period,
+                               self.metric_names)
+            job_data.request(ctx.db, archive, ctx.flights)
+
+        with self.lock:
+            if since is None:
+                self.metrics = {}
+            self.metrics.update(job_data.metrics)
+            self.interval = job_data.interval
+            # drop the buckets out of the window of the period
+            duration = periods[self.period]
+            if duration is not None and self.metrics:
+                last = max([int(timestamp) for timestamp in self.metrics])
+                for timestamp in self.metrics.keys():
+                    if int(timestamp) < last - duration * 1000:
+                        del self.metrics[timestamp]
+
+        return (job_data.metrics, since is None, job)
+
+    def run(self):
+
+        ctx = self.registry.ctx
+        logger.debug("stream of job %d on cluster %s started",
+                     self.jobid, self.cluster)
+        while True:
+            Profiler.reset()
+            try:
+                (metrics, reset, job) = self.poll()
+            except IndexError as err:
+                # job unknown according to Slurm API
+                self.registry.remove(self)
+                self.publish('end', {'error': str(err)})
+                break
+            except Exception as err:
+                logger.warning("error while polling job %d on cluster %s: "
+                               "%s", self.jobid, self.cluster, err)
+            else:
+                self.publish('metrics', {'data': metrics,
+                                         'metrics': self.metric_names,
+                                         'interval': self.interval,
+                                         'reset': reset,
+                                         'debug': Profiler().dump()})
+                if job.terminated:
+                    self.registry.remove(self)
+                    self.publish('end', {'state': job.state})
+                    break
+
+            self.registry.stopped.wait(ctx.conf.stream_interval)
+            if self.registry.stopped.is_set() \
+               or self.registry.remove(self, unused=True):
+                break
+        logger.debug("stream of job %d on cluster %s stopped",
+                     self.jobid, self.cluster)
+
+
+class StreamRegistry(object):
+
+    def __init__(self, ctx):
+
+        self.ctx = ctx
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # (cluster, jobid, period, metrics) -> JobStream
+        self.streams = {}
+        # number of subscribers of all the streams
+        self.clients = 0
+
+    def subscribe(self, cluster, jobid, period, metrics):
+        """Returns the stream of the metrics of the job and the queue of
+           events of a new subscriber. The stream is started if not already
+           running. Returns None if the maximum number of clients is
+           reached."""
+
+        with self.lock:
+            if self.clients >= self.ctx.conf.stream_max_clients:
+                return None
+            self.clients += 1
+            stream = self.streams.get((cluster, jobid, period,
+                                       tuple(metrics)))
+            if stream is None:
+                stream = JobStream(self, cluster, jobid, period, metrics)
+                self.streams[stream.key] = stream
+                stream.start()
+            return (stream, stream.subscribe())
+
+    def unsubscribe(self, stream, events):
+
+        if stream.unsubscribe(events):
+            with self.lock:
+                self.clients -= 1
+
+    def remove(self, stream, unused=False):
+        """Remove the stream from the registry. If unused is True, it is
+           removed only if it has no subscriber. Returns True if removed."""
+
+        with self.lock:
+            if unused and stream.subscribers:
+                return False
+            if self.streams.get(stream.key) is stream:
+                del self.streams[stream.key]
+            return True
@@ -0,0 +1,101 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+"""Efficiency summary of a job computed out of its metrics in one vectorized
+   pass. It requires NumPy."""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def summarize(job_data):
+    """Returns the dict of the efficiency figures of the job out of the
+       metrics of the JobData:
+
+       - the mean and 95th percentile of the CPU efficiency, the ratio in
+         percent of the user CPU time to the allocated CPUs,
+       - the share in percent of the iowait CPU time in the total CPU time,
+       - the peak memory RSS and PSS in bytes,
+       - the mean and max GPU utilization and the peak GPU memory
+         utilization, summed over the GPUs of the job.
+
+       The figures are None when the job has no metrics or when their
+       metrics are not collected on the cluster.
+    """
+
+    job = job_data.job
+    (timestamps, columns) = job_data.columns()
+    summary = {'state': job.state,
+               'start_time': job.start_time,
+               'end_time': job.end_time,
+               'nodes': str(job.nodeset),
+               'interval': job_data.interval,
+               'points': len(timestamps),
+               'cpu_efficiency_mean': None,
+               'cpu_efficiency_p95': None,
+               'iowait_share': None,
+               'rss_peak': None,
+               'pss_peak': None,
+               'gpu_utilization_mean': None,
+               'gpu_utilization_max': None,
+               'gpu_memory_peak': None}
+    if not timestamps:
+        return summary
+
+    names = job_data.metric_names
+    values = np.array(columns, dtype=np.float64)
+
+    def column(metric):
+        return values[names.index(metric)]
+
+    def available(*metrics):
+        return all([metric in names for metric in metrics])
+
+    if available('cpus', 'cpu-user'):
+        cpus = column('cpus')
+        allocated = cpus > 0
+        if allocated.any():
+            efficiency = column('cpu-user')[allocated] / cpus[allocated]
+            summary['cpu_efficiency_mean'] = float(efficiency.mean())
+            summary['cpu_efficiency_p95'] = \
+                float(np.percentile(efficiency, 95))
+
+    cpu_metrics = ['cpu-system', 'cpu-iowait', 'cpu-user', 'cpu-softirq',
+                   'cpu-idle']
+    if available(*cpu_metrics):
+        cpu_total = sum([column(metric).sum() for metric in cpu_metrics])
+        if cpu_total > 0:
+            summary['iowait_share'] = \
+                float(column('cpu-iowait').sum() * 100 / cpu_total)
+
+    if available('memory-rss'):
+        summary['rss_peak'] = float(column('memory-rss').max())
+    if available('memory-pss'):
+        summary['pss_peak'] = float(column('memory-pss').max())
+    if available('utilization_gpu'):
+        summary['gpu_utilization_mean'] = \
+            float(column('utilization_gpu').mean())
+        summary['gpu_utilization_max'] = \
+            float(column('utilization_gpu').max())
+    if available('utilization_memory'):
+        summary['gpu_memory_peak'] = \
+            float(column('utilization_memory').max())
+    return summary
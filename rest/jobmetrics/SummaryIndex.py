@@ -0,0 +1,112 @@
+#!flask/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 EDF SA
+#
+# This file is part of jobmetrics.
+#
+# jobmetrics is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# jobmetrics is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with jobmetrics.  If not, see <http://www.gnu.org/licenses/>.
+"""The SummaryIndex class stores the efficiency summaries of the terminated
+   jobs in a local SQLite database, shared by all the WSGI processes, so that
+   they are computed only once. The index is best-effort: it is opened on
+   first use and its errors are logged, the summaries are then computed
+   again."""
+
+import logging
+logger = logging.getLogger(__name__)
+
+import os
+import json
+import sqlite3
+import threading
+
+
+class SummaryIndex(object):
+
+    def __init__(self, path):
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.created = False
+
+    def create(self):
+        """Create the database and its table if not already done."""
+
+        with self.lock:
+            if self.created:
+                return
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                # WAL journal lets readers proceed while another process
+                # writes
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS summaries ("
+                             "cluster TEXT NOT NULL, "
+                             "jobid INTEGER NOT NULL, "
+                             "summary TEXT NOT NULL, "
+                             "PRIMARY KEY (cluster, jobid))")
+                conn.commit()
+            finally:
+                conn.close()
+            self.created = True
+
+    def connect(self):
+        """Returns a new connection to the database, created on first use.
+           The connections are not shared between threads."""
+
+        self.create()
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, cluster, jobids):
+        """Returns a dict with the job IDs as keys and the summaries of the
+           jobs found in index as values."""
+
+        result = {}
+        try:
+            conn = self.connect()
+            try:
+                # SQLite limits the number of parameters of a query
+                for idx in range(0, len(jobids), 500):
+                    chunk = jobids[idx:idx + 500]
+                    rows = conn.execute(
+                        "SELECT jobid, summary FROM summaries "
+                        "WHERE cluster = ? AND jobid IN (%s)"
+                        % (', '.join(['?'] * len(chunk))),
+                        [cluster] + chunk)
+                    for (jobid, summary) in rows:
+                        result[jobid] = json.loads(summary)
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError, IOError) as err:
+            logger.warning("unable to read summary index %s: %s",
+                           self.path, err)
+        return result
+
+    def put(self, cluster, jobid, summary):
+
+        try:
+            conn = self.connect()
+            try:
+                conn.execute("INSERT OR REPLACE INTO summaries "
+                             "(cluster, jobid, summary) VALUES (?, ?, ?)",
+                             (cluster, jobid, json.dumps(summary)))
+                conn.commit()
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError, IOError) as err:
+            logger.warning("unable to write summary index %s: %s",
+                           self.path, err)